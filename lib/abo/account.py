@@ -668,6 +668,9 @@ class Chart(object):
     def has_wild_account(self):
         return len(self._wild) != 0
 
+    def is_wild_child(self, account):
+        return account.parent is not None and account.parent in self._wild
+
     def tags(self):
         return sorted(self._tags)
 
@@ -764,7 +767,8 @@ class Chart(object):
         lines = abo.text.undent_lines(lines)
         stack = []
         for line in lines:
-            if not line or line.startswith('#'):
+            text = line.string
+            if not text or text.startswith('#'):
                 continue
             name = None
             if line.indent < len(stack):
@@ -772,7 +776,7 @@ class Chart(object):
             tags = set()
             wild = False
             if is_legacy:
-                m = self._regex_legacy_line.match(line)
+                m = self._regex_legacy_line.match(text)
                 if not m:
                     raise abo.text.LineError('malformed line', line=line)
                 label = m.group('label')
@@ -800,7 +804,7 @@ class Chart(object):
             else:
                 label = None
                 atype = None
-                line_notags, tags = self.parse_tags(line)
+                text, tags = self.parse_tags(text)
                 for tag in tags:
                     try:
                         tag_atype = tag_to_atype[tag]
@@ -809,17 +813,16 @@ class Chart(object):
                         atype = tag_atype
                     except KeyError:
                         pass
-                line = line_notags
                 if atype is None and stack:
                     atype = stack[-1].atype
-                if line == '*':
+                if text == '*':
                     wild = True
                 else:
-                    m = self._regex_label.search(line)
+                    m = self._regex_label.search(text)
                     if m:
-                        label = str(m.group(1))
-                        line = line[:m.start(0)] + line[m.end(0):]
-                    name = ' '.join(line.split())
+                        label = m.group(1)
+                        text = text[:m.start(0)] + text[m.end(0):]
+                    name = ' '.join(text.split())
                     if not name and not label:
                         raise abo.text.LineError('missing name or label', line=line)
             assert line.indent == len(stack)
@@ -857,12 +860,16 @@ class ChartCache(abo.cache.FileCache):
         accounts = self.get(**kwargs)
 
 def log_transaction(t, indent='', indent1=None):
+    if not logging.root.isEnabledFor(logging.DEBUG):
+        return
     i = indent1 if indent1 is not None else indent
     for line in t.journal_lines():
         logging.debug(i + line)
         i = indent
 
 def log_entries(entries, indent='', indent1=None):
+    if not logging.root.isEnabledFor(logging.DEBUG):
+        return
     i = indent1 if indent1 is not None else indent
     for e in entries:
         logging.debug(i + e.journal_line())
@@ -881,7 +888,7 @@ def remove_account(chart, pred, transactions, cancel_only=False):
         keep = []
         keep_total = 0
         for e in t.entries:
-            if pred(chart[e.account]):
+            if pred(e.resolve(chart)):
                 s = sign(e.amount)
                 remove_by_sign[s].amount += e.amount
                 remove_by_sign[s].entries.append(e)
@@ -900,7 +907,7 @@ def remove_account(chart, pred, transactions, cancel_only=False):
             if remove_amount == 0:
                 assert keep
                 assert keep_total == 0
-                done.append(t.replace(entries=keep))
+                done.append(t._derive(keep, ordered=True))
                 logging.debug("   cancelled whole transaction")
                 log_transaction(done[-1], indent1="   ", indent="      ")
                 continue
@@ -912,7 +919,7 @@ def remove_account(chart, pred, transactions, cancel_only=False):
                 assert sum(e.amount for e in e1) == -remove_by_sign[-s].amount
                 assert sum(e.amount for e in e2) == remove_amount
                 remove = e2
-                t = t.replace(entries= chain(e2 + keep))
+                t = t._derive(chain(e2 + keep))
                 log_transaction(t, indent1="   cancelled to ", indent="      ")
         elif remove_by_sign[1].entries:
             remove_amount = remove_by_sign[1].amount
@@ -948,8 +955,8 @@ def remove_account(chart, pred, transactions, cancel_only=False):
             k1, k2 = abo.transaction._divide_entries(keep, -amount)
             assert sum(e.amount for e in k1) == -amount
             assert k2
-            todo.insert(0, t.replace(entries= chain(remove + k2)))
-            todo.insert(0, t.replace(entries= chain(entries + k1)))
+            todo.insert(0, t._derive(chain(remove + k2)))
+            todo.insert(0, t._derive(chain(entries + k1)))
             logging.debug("   divide into:")
             log_transaction(todo[0], indent1= "      todo[0] ", indent="         ")
             log_transaction(todo[1], indent1= "      todo[1] ", indent="         ")
@@ -974,7 +981,7 @@ def remove_account(chart, pred, transactions, cancel_only=False):
                     keep = k2
                     keep_total = sum(e.amount for e in keep)
                 assert sum(e.amount for e in k1) == queue[0].amount, 'k1=%r, queue[0]=%r' % (k1, queue[0])
-                done.append(t.replace(entries= [e for e in chain(k1, queue[0].transaction.entries) if e.account != account]))
+                done.append(t._derive([e for e in chain(k1, queue[0].transaction.entries) if e.account != account]))
                 log_transaction(done[-1], indent1="   done ", indent="      ")
                 amount += queue[0].amount
                 if amount:
@@ -1009,8 +1016,8 @@ def remove_account(chart, pred, transactions, cancel_only=False):
                 qo1, qo2 = abo.transaction._divide_entries(qo, amount)
                 assert sum(e.amount for e in qa1) == -amount
                 assert sum(e.amount for e in qo1) == amount
-                done.append(t.replace(entries= list(chain(k1, qo1))))
+                done.append(t._derive(list(chain(k1, qo1))))
                 log_transaction(done[-1], indent1="   done ", indent="      ")
                 queue[0].amount += amount
-                queue[0].transaction = t.replace(entries= list(chain(qa2, qo2)))
+                queue[0].transaction = t._derive(list(chain(qa2, qo2)))
     return done
@@ -92,14 +92,14 @@ class API(object):
         invoice_entries = defaultdict(lambda: [])
         for t in self._all_transactions:
             for e in t.entries:
-                acc = self._chart[e.account]
+                acc = e.resolve(self._chart)
                 ref = API_Invoice._extract_ref(e)
                 if ref and acc.is_receivable():
                     invoice_entries[ref].append(e)
                 else:
                     self._movements.append(API_Entry(self, e))
         for ref, entries in invoice_entries.items():
-            accounts = frozenset(self._chart[e.account].accrual_parent() for e in entries)
+            accounts = frozenset(e.resolve(self._chart).accrual_parent() for e in entries)
             if len(accounts) != 1:
                 raise LineError('invoice %s has inconsistent accounts: %s' % (ref, ', '.join(str(a) for a in sorted(accounts))))
             account = next(iter(accounts))
@@ -130,8 +130,7 @@ class API(object):
     @property
     def _all_transactions(self):
         transactions = abo.cache.all_transactions(self.config, self.opts)
-        transactions.sort(key=lambda t: (t.date, t.who or '', t.what or '', -t.amount()))
-        return iter(transactions)
+        return iter(sorted(transactions, key=lambda t: (t.date, t.who or '', t.what or '', -t.amount())))
 
 class API_Account(object):
 
@@ -277,7 +276,7 @@ class API_Invoice(API_Movement):
         self._entries = tuple(sorted(entries, key=lambda e: (e.transaction.date, e.cdate or datetime.date.min, e.transaction.description(), e.detail, e.amount)))
         invref = 'inv:' + ref
         for e in self._entries:
-            assert self._api._chart[e.account] in self.account._account
+            assert e.resolve(self._api._chart) in self.account._account
             assert self._extract_ref(e) == ref
             #assert e.transaction.date == self.date, 'e.transaction.date=%r, self.date=%r' % (e.transaction.date, self.date)
 
@@ -346,7 +345,7 @@ class API_Invoice(API_Movement):
                 for e in entries:
                     transdesc = self._strip_ref(e.transaction.description())
                     detail = []
-                    account = self._api._chart[e.account]
+                    account = e.resolve(self._api._chart)
                     if account is not self.account._account:
                         detail.append(account.relative_name(self.account._account))
                     detail.append(self._strip_ref(e.detail))
@@ -487,7 +486,7 @@ class API_Entry(API_Movement):
         desc = []
         desc.append(trans.description)
         detail = []
-        account = api._chart[entry.account]
+        account = entry.resolve(api._chart)
         relname = account.accrual_relative_name()
         if relname:
             detail.append(relname)
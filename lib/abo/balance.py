@@ -78,8 +78,8 @@ if __name__ == "__main__":
     doctest.testmod(abo.balance)
 
 from collections import defaultdict
-from itertools import chain
-from abo.types import struct
+from itertools import chain, count
+from abo.money import MoneyVector
 import abo.transaction
 
 class Balance(object):
@@ -88,34 +88,14 @@ class Balance(object):
         self.date_range = date_range
         self.first_date = None
         self.last_date = None
-        self._raw_balances = defaultdict(lambda: struct(cdate=defaultdict(lambda: 0), total=0))
+        # The raw tallies are held in a MoneyVector, indexed by account and
+        # cdate, so that each entry is tallied by a single integer addition.
+        self._raw_slots = defaultdict(dict)
         if chart:
             for acc in chart.substantial_accounts():
-                self._raw_balances[acc].total = 0
-        for t in transactions:
-            date = t.edate if use_edate else t.date
-            if self.date_range is None or date in self.date_range:
-                if self.first_date is None or date < self.first_date:
-                    self.first_date = date
-                if self.last_date is None or date > self.last_date:
-                    self.last_date = date
-                for e in t.entries:
-                    if entry_pred is None or entry_pred(e):
-                        acc = e.account
-                        if chart:
-                            acc = chart[acc]
-                            assert acc is not None
-                            assert acc.is_substantial(), 'acc=%r' % (acc,)
-                        if acc_map is not None:
-                            mapped = acc_map(acc)
-                            if mapped is not None:
-                                acc = mapped
-                        cdate = None if e.cdate is None or self.date_range is None or e.cdate in self.date_range else e.cdate
-                        rb = self._raw_balances[acc]
-                        rb.cdate[cdate] += e.amount
-                        rb.total += e.amount
+                self._raw_slots[acc]
         self.pred = lambda a, m: True
-        self._balances = None
+        _tally_ranges([self], transactions, chart=chart, entry_pred=entry_pred, acc_map=acc_map, use_edate=use_edate)
 
     def __repr__(self):
         return 'Balance(%r)' % self.date_range
@@ -126,22 +106,65 @@ class Balance(object):
         copy.first_date = self.first_date
         copy.last_date = self.last_date
         copy.pred = self.pred
-        copy._raw_balances = self._raw_balances
+        copy._raw_slots = self._raw_slots
+        copy._raw = self._raw
         copy._balances = None
         return copy
 
+    def raw_tallies(self):
+        r"""Return the raw per-account, per-cdate tallies of this Balance in a
+        form that can be pickled, with every Account replaced by its full name,
+        to be restored by from_raw_tallies().
+        """
+        accounts = []
+        for acc, slots in self._raw_slots.items():
+            name = acc if isinstance(acc, str) else acc.full_name()
+            accounts.append((name, isinstance(acc, str), slots))
+        return (self.first_date, self.last_date, accounts, self._raw)
+
+    @classmethod
+    def from_raw_tallies(cls, tallies, date_range=None, chart=None):
+        r"""Return a Balance with the given raw tallies, as returned by
+        raw_tallies(), looking up account names in the given chart.
+        >>> from abo.transaction import Transaction
+        >>> t1 = Transaction(date=1, what="One",
+        ...         entries=({'account':'a1', 'amount':14.56}, {'account':'a2', 'amount':-14.56, 'cdate': 6}))
+        >>> b = Balance([t1], date_range=Range(1, 4))
+        >>> c = Balance.from_raw_tallies(b.raw_tallies(), date_range=Range(1, 4))
+        >>> c.first_date, c.last_date, c.accounts
+        (1, 1, ('a1', 'a2'))
+        >>> c.balance('a2'), c.cbalance('a2')
+        (-14.56, 0)
+        """
+        self = cls([], date_range=date_range)
+        self.first_date, self.last_date, accounts, self._raw = tallies
+        for name, is_str, slots in accounts:
+            self._raw_slots[name if is_str else chart[name]] = slots
+        return self
+
     def set_predicate(self, pred):
         self.pred = pred
         self._balances = None
 
     def _tally(self):
         if self._balances is None:
-            self._balances = defaultdict(lambda: defaultdict(lambda: 0))
-            for account, rb in self._raw_balances.items():
-                if self.pred(account, rb.total):
-                    for cdate, amount in rb.cdate.items():
+            self._balances = defaultdict(dict)
+            nslots = 0
+            indices = []
+            sources = []
+            for account, slots in self._raw_slots.items():
+                if self.pred(account, self._raw.total(slots.values())):
+                    for cdate, i in slots.items():
                         for acc in chain(iter_lineage(account), [None]):
-                            self._balances[acc][cdate] += amount
+                            tslots = self._balances[acc]
+                            j = tslots.get(cdate)
+                            if j is None:
+                                j = tslots[cdate] = nslots
+                                nslots += 1
+                            indices.append(j)
+                            sources.append(i)
+            self._totals = MoneyVector(nslots)
+            self._totals.scatter_add(indices, self._raw.gather(sources))
 
     @property
     def accounts(self):
@@ -150,23 +173,112 @@ class Balance(object):
 
     def balance(self, account=None):
         self._tally()
-        return sum(self._balances[account].values()) if account in self._balances else 0
+        return self._totals.total(self._balances[account].values()) if account in self._balances else 0
 
     def cbalance(self, account=None):
         self._tally()
-        return self._balances[account][None]
+        i = self._balances[account].get(None) if account in self._balances else None
+        return self._totals[i] if i is not None else 0
 
     def entries(self):
         self._tally()
-        without_cdate = []
-        with_cdate = []
-        for account, amounts in self._balances.items():
+        for account, slots in self._balances.items():
             if account is not None:
-                if amounts[None]:
-                    yield abo.transaction.Entry(transaction=None, amount=amounts[None], account=account)
-                for cdate in sorted(d for d in amounts if d is not None):
-                    if amounts[cdate]:
-                        yield abo.transaction.Entry(transaction=None, amount=amounts[cdate], account=account, cdate=cdate)
+                i = slots.get(None)
+                if i is not None and self._totals[i]:
+                    yield abo.transaction.Entry(transaction=None, amount=self._totals[i], account=account)
+                for cdate in sorted(d for d in slots if d is not None):
+                    amount = self._totals[slots[cdate]]
+                    if amount:
+                        yield abo.transaction.Entry(transaction=None, amount=amount, account=account, cdate=cdate)
+
+class MultiBalance(object):
+
+    r"""A sequence of Balances of the same transactions, one for each of a
+    list of ranges, computed in a single pass over the transactions, so that
+    the predicate, chart and account map are applied to each entry only once,
+    however many ranges it falls in.
+
+    >>> from abo.transaction import Transaction
+    >>> t1 = Transaction(date=1, what="One",
+    ...         entries=({'account':'a1', 'amount':14.56}, {'account':'a2', 'amount':-14.56}))
+    >>> t2 = Transaction(date=3, what="Two",
+    ...         entries=({'account':'a1', 'amount':-2.50}, {'account':'a2', 'amount':2.50, 'cdate': 6}))
+    >>> t3 = Transaction(date=5, what="Three",
+    ...         entries=({'account':'a1', 'amount':100.00}, {'account':'a2', 'amount':-100.00, 'cdate': 5}))
+    >>> m = MultiBalance([t1, t2, t3], [Range(1, 2), Range(3, 4), Range(None, 4), Range(6, 9)])
+    >>> len(m)
+    4
+    >>> [(b.first_date, b.last_date) for b in m]
+    [(1, 1), (3, 3), (1, 3), (None, None)]
+    >>> [b.balance('a1') for b in m]
+    [14.56, -2.5, 12.06, 0]
+    >>> [b.cbalance('a2') for b in m]
+    [-14.56, 0, -14.56, 0]
+    >>> m[1].date_range
+    Range(3, 4)
+    """
+
+    def __init__(self, transactions, date_ranges, chart=None, entry_pred=None, acc_map=None, use_edate=False):
+        self.balances = [Balance([], date_range=r, chart=chart) for r in date_ranges]
+        _tally_ranges(self.balances, transactions, chart=chart, entry_pred=entry_pred, acc_map=acc_map, use_edate=use_edate)
+
+    def __repr__(self):
+        return 'MultiBalance(%r)' % ([b.date_range for b in self.balances],)
+
+    def __len__(self):
+        return len(self.balances)
+
+    def __getitem__(self, index):
+        return self.balances[index]
+
+    def __iter__(self):
+        return iter(self.balances)
+
+def _tally_ranges(balances, transactions, chart=None, entry_pred=None, acc_map=None, use_edate=False):
+    # Tally the raw slots of all the given (empty) Balances in one pass over
+    # the transactions.  The Balances whose ranges contain a date are found
+    # once per distinct date, and each entry is resolved and mapped once,
+    # whatever the number of Balances it is tallied in.
+    columns = [(b, b.date_range, b._raw_slots, count(), [], []) for b in balances]
+    buckets = {}
+    for t in transactions:
+        date = t.edate if use_edate else t.date
+        bucket = buckets.get(date)
+        if bucket is None:
+            bucket = buckets[date] = [c for c in columns if c[1] is None or date in c[1]]
+        if not bucket:
+            continue
+        for c in bucket:
+            b = c[0]
+            if b.first_date is None or date < b.first_date:
+                b.first_date = date
+            if b.last_date is None or date > b.last_date:
+                b.last_date = date
+        for e in t.entries:
+            if entry_pred is None or entry_pred(e):
+                if chart:
+                    acc = e.resolve(chart)
+                    assert acc is not None
+                    assert acc.is_substantial(), 'acc=%r' % (acc,)
+                else:
+                    acc = e.account
+                if acc_map is not None:
+                    mapped = acc_map(acc)
+                    if mapped is not None:
+                        acc = mapped
+                for b, date_range, raw_slots, counter, indices, amounts in bucket:
+                    cdate = None if e.cdate is None or date_range is None or e.cdate in date_range else e.cdate
+                    slots = raw_slots[acc]
+                    i = slots.get(cdate)
+                    if i is None:
+                        i = slots[cdate] = next(counter)
+                    indices.append(i)
+                    amounts.append(e.amount)
+    for b, date_range, raw_slots, counter, indices, amounts in columns:
+        b._raw = MoneyVector(next(counter))
+        b._raw.scatter_add(indices, amounts)
+        b._balances = None
 
 def iter_lineage(account):
     while account:
@@ -198,6 +310,13 @@ class Range(object):
     def __repr__(self):
         return 'Range(%r, %r)' % (self.first, self.last)
 
+    def key(self):
+        r"""Return a value that identifies this range, even in another process.
+        >>> Range(1, 4).key(), Range.past().key()
+        ((1, 4), ('undef', None))
+        """
+        return tuple('undef' if value is self._undef else value for value in (self.first, self.last))
+
     def __contains__(self, item):
         if self.first is self._undef or self.last is self._undef:
             return False
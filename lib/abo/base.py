@@ -1,6 +1,8 @@
 unique_id = 0
 
 class Base(object):
+    __slots__ = ()
+
     def _make_unique_id(self):
         global unique_id
         unique_id += 1
@@ -5,56 +5,214 @@
 """Transaction cache.
 """
 
+if __name__ == "__main__":
+    import sys
+    if sys.path[0] == sys.path[1] + '/abo':
+        del sys.path[0]
+    import doctest
+    import abo.cache
+    doctest.testmod(abo.cache)
+
 import logging
 import os
 import os.path
 import errno
+import time
 import pickle
+import hashlib
+import fcntl
+import atexit
+import contextlib
+from collections import Counter
+from itertools import chain
 import concurrent.futures
 import abo.config
 import abo.text
+import abo.timing
+from abo.types import struct
 
 class ContentError(Exception):
     pass
 
+# Increment whenever the format of cached content or manifests changes, so that
+# existing cache entries are recompiled rather than misinterpreted.
+CACHE_VERSION = 8
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    return h.digest()
+
+@contextlib.contextmanager
+def atomic_open(path):
+    r"""Open a temporary file for writing, and when done, rename it to the given
+    path, so that readers only ever see a complete file.
+    """
+    tmppath = '%s.%u.tmp' % (path, os.getpid())
+    try:
+        with open(tmppath, 'wb') as f:
+            yield f
+        os.replace(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+
+# Counts of cache events in this process, added to the cache directory's
+# statistics file on exit.
+_stats = Counter()
+_stats_dirs = set()
+
+def count(config, event, n=1):
+    if not _stats_dirs:
+        atexit.register(flush_stats)
+    _stats_dirs.add(os.path.abspath(config.cache_dir_path))
+    _stats[event] += n
+
+def flush_stats():
+    global _stats
+    counts, _stats = _stats, Counter()
+    if not counts:
+        return
+    for dirpath in _stats_dirs:
+        try:
+            path = os.path.join(dirpath, 'stats')
+            with open(path + '.lock', 'a') as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                totals = read_stats(dirpath)
+                totals.update(counts)
+                with atomic_open(path) as f:
+                    pickle.dump(dict(totals), f, 2)
+        except OSError as e:
+            logging.debug("cannot update cache statistics in %r: %s" % (dirpath, e))
+
+def read_stats(dirpath):
+    try:
+        with open(os.path.join(dirpath, 'stats'), 'rb') as f:
+            return Counter(pickle.load(f))
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return Counter()
+
+def load_manifest(path):
+    try:
+        with open(path, 'rb') as f:
+            manifest = pickle.load(f)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    except (pickle.UnpicklingError, EOFError, UnicodeDecodeError, AttributeError, ImportError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != CACHE_VERSION:
+        return None
+    return manifest
+
 class Cache(object):
 
+    r"""The compiled form of one or more source files.  A manifest alongside
+    the compiled file records the modification time, size and content digest
+    of every source file, so that touching a source without changing its
+    content (eg, by a checkout or restore) does not cause a recompile.
+    """
+
+    content_format = 'pickle'
+
     def __init__(self, config, opts, ident, deppaths=()):
         self.config = config
         self.opts = opts
         self.ident = ident
-        self.cpath = os.path.join(self.config.cache_dir_path, self.ident.replace('/', '%%'))
-        self.ctime = -1 if self.opts and self.opts['--force'] else self.mtime(self.cpath)
-        self.deppaths = list(deppaths)
+        self.cpath = os.path.abspath(os.path.join(self.config.cache_dir_path, self.ident.replace('/', '%%')))
+        self.mpath = self.cpath + '.manifest'
+        self.lpath = self.cpath + '.lock'
+        self.force = bool(self.opts and self.opts['--force'])
+        self.deppaths = [os.path.abspath(path) for path in deppaths]
+        self.manifest = None
+        self.deps = None
         self.content = None
 
     def source_paths(self):
         for path in self.deppaths:
             yield path
 
-    def source_mtime(self):
-        return max(self.mtime(path) for path in self.source_paths())
+    def load_manifest(self):
+        return load_manifest(self.mpath)
+
+    def save_manifest(self, manifest):
+        with atomic_open(self.mpath) as f:
+            pickle.dump(manifest, f, 2)
+        self.manifest = manifest
+
+    def source_fingerprints(self):
+        deps = {}
+        for path in self.source_paths():
+            st = os.stat(path)
+            deps[path] = (st.st_mtime_ns, st.st_size, file_digest(path))
+        return deps
 
     def is_dirty(self):
-        return self.ctime < self.source_mtime()
+        with abo.timing.phase('stat', self.ident):
+            return self._is_dirty()
+
+    def _is_dirty(self):
+        if self.force:
+            return True
+        if self.manifest is None:
+            self.manifest = self.load_manifest()
+        if self.manifest is None or not os.path.exists(self.cpath):
+            return True
+        if self.manifest.get('format', 'pickle') != self.content_format:
+            return True
+        deps = self.manifest['deps']
+        if set(deps) != set(self.source_paths()):
+            return True
+        touched = {}
+        for path, (mtime, size, digest) in deps.items():
+            st = self.stat(path)
+            if st is None or st.st_size != size:
+                return True
+            if st.st_mtime_ns != mtime:
+                if file_digest(path) != digest:
+                    return True
+                touched[path] = (st.st_mtime_ns, size, digest)
+        if touched:
+            logging.debug("touched %r" % sorted(touched))
+            count(self.config, 'touched')
+            manifest = dict(self.manifest)
+            manifest['deps'] = dict(deps, **touched)
+            self.save_manifest(manifest)
+        return False
 
     def get(self):
         try:
             if self.is_dirty():
-                logging.debug("compile %r" % self.ident)
                 try:
                     os.makedirs(os.path.dirname(self.cpath))
                 except OSError as e:
                     if e.errno != errno.EEXIST:
                         raise
-                content = self.make_content()
-                pickle.dump(content, open(self.cpath, 'wb'), 2)
-                self.ctime = self.mtime(self.cpath)
-                self.content = content
-            elif self.content is None:
+                # Only one process at a time may compile a given cache entry.
+                # Any others wait for it to finish, then use its result.
+                with open(self.lpath, 'a') as lockf:
+                    with abo.timing.phase('lock', self.ident):
+                        fcntl.flock(lockf, fcntl.LOCK_EX)
+                    self.manifest = None
+                    if self.is_dirty():
+                        self.compile()
+                    else:
+                        logging.debug("compiled by another process %r" % self.ident)
+                        count(self.config, 'waited')
+                        self.content = None
+            if self.content is None:
                 try:
                     logging.debug("load %r" % self.cpath)
-                    self.content = pickle.load(open(self.cpath, 'rb'))
+                    with abo.timing.phase('load', self.ident):
+                        self.content = self.read_content()
+                    count(self.config, 'loaded')
                 except (pickle.UnpicklingError, UnicodeDecodeError):
                     pass
             return self.content
@@ -63,14 +221,47 @@ class Cache(object):
         except Exception as e:
             return e
 
+    def compile(self):
+        logging.debug("compile %r" % self.ident)
+        with abo.timing.phase('compile', self.ident):
+            # Fingerprint the sources before compiling, so that a source
+            # modified during compilation will be detected next time.
+            self.deps = self.source_fingerprints()
+            content = self.make_content()
+            manifest = self.manifest_fields(content)
+            content = self.write_content(content)
+        manifest.update(version=CACHE_VERSION, format=self.content_format, deps=self.deps)
+        self.save_manifest(manifest)
+        self.force = False
+        self.content = content
+        count(self.config, 'compiled')
+
+    def manifest_fields(self, content):
+        r"""Return a dict of any facts about the given content to record in the
+        manifest, so that they are known without loading the content.
+        """
+        return {}
+
+    def write_content(self, content):
+        r"""Write the given content to the cache file, and return the content
+        to be retained in memory.
+        """
+        with atomic_open(self.cpath) as f:
+            pickle.dump(content, f, 2)
+        return content
+
+    def read_content(self):
+        with open(self.cpath, 'rb') as f:
+            return pickle.load(f)
+
     @staticmethod
-    def mtime(path):
+    def stat(path):
         try:
-            return os.stat(path).st_mtime
+            return os.stat(path)
         except OSError as e:
             if e.errno != errno.ENOENT:
                 raise
-            return -1
+            return None
 
 class FileCache(Cache):
 
@@ -83,53 +274,947 @@ class FileCache(Cache):
 
 class ChartCache(FileCache):
 
+    r"""The chart of accounts compiled from the chart file alone.  Wild accounts
+    are not instantiated here, because that would make the chart depend on
+    every journal; instead each journal records the wild account names it
+    uses, and chart() merges them in.
+    """
+
     def __init__(self, config, opts):
-        FileCache.__init__(self, config, opts, path=config.chart_file_path, otherpaths=config.journal_file_paths)
+        FileCache.__init__(self, config, opts, path=config.chart_file_path)
 
     def make_content(self):
         logging.info("compile %r", self.config.chart_file_path)
         import abo.account
-        chart = abo.account.Chart.from_file(self.config.open(self.config.chart_file_path))
-        if chart.has_wild_account():
-            # Iterate over all accounts named in all transactions, in order to
-            # instantiate all wild accounts.
-            for t in all_transactions(self.config, self.opts):
-                for e in t.entries:
-                    chart[e.account]
-        return chart
+        return abo.account.Chart.from_file(self.config.open(self.config.chart_file_path))
+
+class FilterCache(object):
+
+    r"""The output of journal %filter commands, keyed by the command's arguments
+    and the digest of its input (see abo.journal), so that a journal recompiled
+    for any other reason, such as a change to the chart, does not run its filter
+    again.  Only the latest output for any given arguments is kept.  The names
+    of the files used are recorded, so that garbage collection can keep them.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.dirpath = os.path.join(config.cache_dir_path, 'filter')
+        self.used = set()
+
+    def _path(self, key):
+        args, digest = key
+        return os.path.join(self.dirpath, hashlib.blake2b(repr(args).encode('utf8'), digest_size=16).hexdigest())
 
+    def open(self, key):
+        r"""Return a binary file open for reading the cached output for the given
+        key, or None if there is none.
+        """
+        try:
+            f = open(self._path(key), 'rb')
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            cached_key = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            cached_key = None
+        if cached_key != key:
+            f.close()
+            return None
+        self.used.add(os.path.basename(f.name))
+        count(self.config, 'filter_avoided')
+        return f
+
+    @contextlib.contextmanager
+    def create(self, key):
+        r"""Return a context manager that gives a binary file open for writing
+        the output for the given key, which replaces any cached output only if
+        the context exits without an exception.
+        """
+        try:
+            os.makedirs(self.dirpath)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        path = self._path(key)
+        with atomic_open(path) as f:
+            pickle.dump(key, f, 2)
+            yield f
+        self.used.add(os.path.basename(path))
+
+_chart_cache = None
+_base_chart = None
 _chart = None
 
+def base_chart(config, opts=None):
+    r"""Return the chart of accounts without any wild accounts instantiated by
+    journals.  Journals are parsed using this chart.
+    """
+    global _base_chart, _chart_cache
+    if _base_chart is None:
+        _chart_cache = ChartCache(config, opts)
+        _base_chart = _chart_cache.get()
+    return _base_chart
+
 def chart(config, opts=None):
     global _chart
     if _chart is None:
-        _chart = ChartCache(config, opts).get()
+        chart = base_chart(config, opts)
+        if not isinstance(chart, Exception) and chart.has_wild_account():
+            # Instantiate all the wild accounts named in all transactions.
+            for name in wild_names(config, opts):
+                chart[name]
+        _chart = chart
     return _chart
 
+def wild_names(config, opts=None):
+    r"""Return the names of the wild accounts used by all journals.  The names
+    used by a compiled journal are recorded in its manifest, so its
+    transactions are only loaded if any journal is not compiled.
+    """
+    names = set()
+    for path in config.journal_file_paths:
+        cache = journal_cache(config, opts, path)
+        if cache.content is not None:
+            names.update(cache.content.wild_names)
+        elif not cache.is_dirty() and 'wild_names' in cache.manifest:
+            names.update(cache.manifest['wild_names'])
+        else:
+            all_transactions(config, opts)
+            return set(chain(*(_journals[os.path.abspath(path)].content.wild_names for path in config.journal_file_paths)))
+    return names
+
 class TransactionCache(FileCache):
 
     def __init__(self, config, opts, path):
         FileCache.__init__(self, config, opts, path, otherpaths=[config.chart_file_path])
+        self.content_format = config.cache_format
+        # The number of processes that may parse the journal.
+        self.workers = 1
 
     def make_content(self):
         import abo.journal
-        return list(abo.journal.Journal(self.config, self.config.open(self.path), chart=chart(self.config, self.opts)).transactions())
+        chart = base_chart(self.config, self.opts)
+        filter_cache = FilterCache(self.config)
+        journal = abo.journal.Journal(self.config, self.config.open(self.path), chart=chart, memo=self.block_memo(),
+                                      filter_cache=filter_cache, workers=self.workers)
+        transactions = list(journal.transactions())
+        names = set(e.account for t in transactions for e in t.entries)
+        wild_names = sorted(name for name in names if chart.is_wild_child(chart[name]))
+        return struct(transactions=transactions, block_keys=journal.block_keys, wild_names=wild_names,
+                      filters=sorted(filter_cache.used))
+
+    def manifest_fields(self, content):
+        return {'wild_names': content.wild_names, 'filters': content.filters}
+
+    def write_content(self, content):
+        if self.content_format == 'columnar':
+            import abo.store
+            abo.store.write(self.cpath, content.transactions, content.block_keys, meta={'wild_names': content.wild_names})
+            return self.read_content()
+        return super(TransactionCache, self).write_content(content)
+
+    def read_content(self):
+        if self.content_format == 'columnar':
+            import abo.store
+            # Block keys are only needed for recompiling, so are not decoded
+            # until then (see block_memo()).
+            store = abo.store.TransactionStore(self.cpath)
+            return struct(transactions=store, block_keys=None, wild_names=store.meta['wild_names'])
+        return super(TransactionCache, self).read_content()
+
+    def block_memo(self):
+        r"""Return a dict that maps the key of every block in the previously
+        compiled journal to the transaction parsed from it, so that only changed
+        blocks need be parsed again.  Transactions depend on the chart of
+        accounts, so the previous content is unusable if the chart has changed.
+        """
+        chart_path = os.path.abspath(self.config.chart_file_path)
+        if (    self.force
+            or  self.manifest is None
+            or  chart_path not in self.manifest['deps']
+            or  self.manifest['deps'][chart_path][2] != self.deps[chart_path][2]
+            or  self.manifest.get('format', 'pickle') != self.content_format):
+            return {}
+        try:
+            old = self.read_content()
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError, UnicodeDecodeError, AttributeError, ImportError):
+            return {}
+        block_keys = old.block_keys if old.block_keys is not None else old.transactions.block_keys()
+        return dict((key, t) for key, t in zip(block_keys, old.transactions) if key is not None)
+
+# Increment whenever the format of frozen journals changes, so that older ones
+# are rejected rather than misinterpreted.
+FROZEN_VERSION = 1
+
+class FrozenCache(Cache):
+
+    r"""A journal frozen by freeze(), whose transactions are loaded from its
+    snapshot with no parsing.  The snapshot is authoritative; the text of the
+    journal is not read, so is not a source.  Every time the snapshot is loaded,
+    its accounts are checked against the chart, which may have changed since.
+    """
+
+    content_format = 'frozen'
+
+    def __init__(self, config, opts, path):
+        self.path = os.path.abspath(path)
+        frozen_path = self.path + abo.config.FROZEN_SUFFIX
+        super(FrozenCache, self).__init__(config, opts, os.path.relpath(frozen_path, config.base_dir_path), [frozen_path])
+        # The snapshot is itself the compiled content.
+        self.cpath = frozen_path
+        self.checked = False
+
+    def make_content(self):
+        return self.read_content()
+
+    def write_content(self, content):
+        return content
+
+    def read_content(self):
+        import abo.store
+        store = abo.store.TransactionStore(self.cpath)
+        if store.meta.get('frozen') != FROZEN_VERSION:
+            raise ContentError('%s: unsupported frozen journal' % (self.cpath,))
+        chart = base_chart(self.config, self.opts)
+        wild_names = []
+        for name in sorted(store.account_names()):
+            try:
+                account = chart[name]
+            except (ValueError, KeyError) as e:
+                raise ContentError('%s: %s' % (self.cpath, e))
+            if chart.is_wild_child(account):
+                wild_names.append(name)
+        return struct(transactions=store, block_keys=None, wild_names=wild_names)
+
+    def _is_dirty(self):
+        if super(FrozenCache, self)._is_dirty():
+            return True
+        if not self.checked:
+            # Warn once if the text of the journal has been edited, because
+            # its edits have no effect.
+            self.checked = True
+            import abo.store
+            meta = abo.store.TransactionStore(self.cpath).meta
+            st = self.stat(self.path)
+            if (    st is not None
+                and (st.st_size, st.st_mtime_ns) != (meta.get('size'), meta.get('mtime_ns'))
+                and file_digest(self.path).hex() != meta.get('digest')):
+                logging.warning("%s has changed since it was frozen; changes are ignored until it is thawed" % (self.path,))
+        return False
+
+def journal_cache(config, opts, path):
+    r"""Return the cache of the transactions of the given journal, re-using
+    the one already in memory unless the journal has since been frozen or
+    thawed.
+    """
+    path = os.path.abspath(path)
+    frozen = os.path.exists(path + abo.config.FROZEN_SUFFIX)
+    cache = _journals.get(path)
+    if cache is None or isinstance(cache, FrozenCache) != frozen:
+        cache = FrozenCache(config, opts, path) if frozen else TransactionCache(config, opts, path)
+    return cache
+
+def _transaction_fields(t):
+    return (t.date, t.edate, t.who, t.what, t.tags, t.is_projection, t.entries)
+
+def freeze(config, opts, path):
+    r"""Write a snapshot of the transactions of the given journal alongside
+    it, which all_transactions() loads from then on instead of parsing the
+    journal, even if the chart changes.  The snapshot is read back and checked
+    against the parsed transactions before it is put in place.  Return the
+    number of transactions.
+    """
+    import abo.store
+    path = os.path.abspath(path)
+    frozen_path = path + abo.config.FROZEN_SUFFIX
+    if os.path.exists(frozen_path):
+        raise ContentError('%s: already frozen' % (path,))
+    st = os.stat(path)
+    digest = file_digest(path)
+    content = TransactionCache(config, opts, path).get()
+    if isinstance(content, Exception):
+        raise content
+    transactions = list(content.transactions)
+    meta = {
+        'frozen': FROZEN_VERSION,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'digest': digest.hex(),
+    }
+    tmppath = '%s.%u.tmp' % (frozen_path, os.getpid())
+    try:
+        abo.store.write(tmppath, transactions, meta=meta)
+        if list(map(_transaction_fields, abo.store.TransactionStore(tmppath))) != list(map(_transaction_fields, transactions)):
+            raise ContentError('%s: snapshot does not reproduce the journal' % (path,))
+        os.replace(tmppath, frozen_path)
+    except:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+    return len(transactions)
+
+def thaw(config, opts, path):
+    r"""Remove the snapshot of the given frozen journal.  If the journal's
+    text no longer exists, first regenerate it from the snapshot, in ledger
+    format, and check that it parses into the same transactions.  Return True
+    if the text was regenerated.
+    """
+    import abo.store
+    import abo.journal
+    path = os.path.abspath(path)
+    frozen_path = path + abo.config.FROZEN_SUFFIX
+    if not os.path.exists(frozen_path):
+        raise ContentError('%s: not frozen' % (path,))
+    store = abo.store.TransactionStore(frozen_path)
+    if store.meta.get('frozen') != FROZEN_VERSION:
+        raise ContentError('%s: unsupported frozen journal' % (frozen_path,))
+    regenerated = False
+    if os.path.exists(path):
+        if file_digest(path).hex() != store.meta['digest']:
+            raise ContentError('%s: changed since it was frozen; move it aside to regenerate it' % (path,))
+    else:
+        text = ''.join(line + '\n' for line in abo.journal.ledger_lines(store))
+        journal = abo.journal.Journal(config, text, chart=base_chart(config, opts))
+        try:
+            transactions = list(journal.transactions())
+        except abo.text.LineError as e:
+            raise ContentError('%s: cannot regenerate: %s' % (path, e))
+        if list(map(_transaction_fields, transactions)) != list(map(_transaction_fields, store)):
+            raise ContentError('%s: cannot regenerate: text does not reproduce the snapshot' % (path,))
+        with atomic_open(path) as f:
+            f.write(text.encode('utf8'))
+        regenerated = True
+    os.unlink(frozen_path)
+    return regenerated
+
+def _get_counted(cache):
+    # Worker processes exit without flushing their statistics or reporting
+    # their timings, so return them to the parent with the content.
+    global _stats
+    _stats = Counter()
+    abo.timing.reset()
+    content = cache.get()
+    return content, _stats, abo.timing.entries()
 
 _all_transactions = {}
+_journals = {}
 
 def all_transactions(config, opts=None):
     global _all_transactions
     key = config.transaction_cache_key()
     transactions = _all_transactions.get(key)
     if transactions is None:
-        caches = [TransactionCache(config, opts, path) for path in config.journal_file_paths]
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            transactions = []
-            for content in executor.map(Cache.get, caches):
-                if isinstance(content, Exception):
-                    raise content
+        caches = [journal_cache(config, opts, path) for path in config.journal_file_paths]
+        # Load clean caches directly, and only compile dirty ones in worker
+        # processes, which are not worth starting for a single cache.
+        dirty = []
+        for cache in caches:
+            if cache.content is None:
+                if cache.is_dirty():
+                    dirty.append(cache)
                 else:
-                    transactions += content
+                    content = cache.get()
+                    if isinstance(content, Exception):
+                        raise content
+        if len(dirty) == 1:
+            # A single large journal may be parsed in chunks by worker
+            # processes instead.
+            dirty[0].workers = os.cpu_count() or 1
+            content = dirty[0].get()
+            if isinstance(content, Exception):
+                raise content
+        elif dirty:
+            with abo.timing.phase('dispatch'), \
+                 concurrent.futures.ProcessPoolExecutor(max_workers=min(len(dirty), os.cpu_count() or 1)) as executor:
+                for cache, (content, counts, timings) in zip(dirty, executor.map(_get_counted, dirty)):
+                    for event, n in counts.items():
+                        count(config, event, n)
+                    abo.timing.merge(timings)
+                    if isinstance(content, Exception):
+                        raise content
+                    cache.content = content
+                    cache.force = False
+                    # The worker wrote a new manifest.
+                    cache.manifest = None
+        transactions = []
+        for cache in caches:
+            transactions += cache.content.transactions
+            _journals[cache.path] = cache
         logging.debug(f"cache {len(transactions)} transactions")
         _all_transactions[key] = transactions
     return transactions
+
+def fingerprint(config, opts=None):
+    r"""Return a digest of the content of every source file of the chart and
+    all transactions, or None if any of them is not compiled.
+    """
+    if _chart_cache is None:
+        return None
+    return _fingerprint(config, opts, _chart_cache)
+
+def _fingerprint(config, opts, chart_cache):
+    caches = [chart_cache]
+    for path in config.journal_file_paths:
+        caches.append(journal_cache(config, opts, path))
+    h = hashlib.blake2b(digest_size=20)
+    for cache in caches:
+        if cache.is_dirty():
+            return None
+        for path, (mtime, size, digest) in sorted(cache.manifest['deps'].items()):
+            h.update(path.encode('utf8'))
+            h.update(digest)
+    return h.digest()
+
+# Values derived from all transactions, such as the tallies of report balances,
+# are cached in a sub-directory, keyed by their parameters and the fingerprint
+# of their sources.  When it grows beyond this size, the least recently used
+# values are evicted.
+AGGREGATE_CACHE_SIZE = 32 << 20
+
+def aggregate(config, opts, key, make):
+    r"""Return the value identified by the given key that is derived from the
+    chart and transactions, calling make() to compute it if it is not cached or
+    any source has changed since it was.  The key and value must be picklable,
+    and the value must not be None.
+    """
+    fp = fingerprint(config, opts)
+    value = load_aggregate(config, key, fp)
+    if value is None:
+        value = make()
+        # Making the value may have compiled the sources, so only now are they
+        # known to be unchanged since it was made.
+        save_aggregate(config, key, fingerprint(config, opts), value)
+    return value
+
+def _aggregate_prefix(fp):
+    # The names of all the values cached for the same sources start with the
+    # same prefix, so that garbage collection can tell which are stale.
+    return hashlib.blake2b(repr((CACHE_VERSION, fp)).encode('utf8'), digest_size=8).hexdigest() + '-'
+
+def _aggregate_path(config, key, fp):
+    ident = _aggregate_prefix(fp) + hashlib.blake2b(repr(key).encode('utf8'), digest_size=16).hexdigest()
+    return os.path.join(config.cache_dir_path, 'aggregate', ident)
+
+def load_aggregate(config, key, fp):
+    r"""Return the value identified by the given key that was saved with the
+    given fingerprint of the sources (see fingerprint()), or None if there is
+    none or the fingerprint is None.
+    """
+    if fp is None:
+        return None
+    path = _aggregate_path(config, key, fp)
+    try:
+        with abo.timing.phase('aggregate'), open(path, 'rb') as f:
+            value = pickle.load(f)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    except (pickle.UnpicklingError, EOFError):
+        return None
+    os.utime(path)
+    logging.debug("load aggregate %r" % (key,))
+    count(config, 'aggregate_loaded')
+    return value
+
+def save_aggregate(config, key, fp, value):
+    r"""Cache the given value with the given key and fingerprint of the sources
+    from which it was made, unless the fingerprint is None.
+    """
+    if fp is None:
+        return
+    path = _aggregate_path(config, key, fp)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    with atomic_open(path) as f:
+        pickle.dump(value, f, 2)
+    count(config, 'aggregate_compiled')
+    evict_aggregates(os.path.dirname(path))
+
+def evict_aggregates(dirpath, size=None):
+    if size is None:
+        size = AGGREGATE_CACHE_SIZE
+    entries = []
+    for name in os.listdir(dirpath):
+        path = os.path.join(dirpath, name)
+        st = Cache.stat(path)
+        if st is not None and not name.endswith('.tmp'):
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(e[1] for e in entries)
+    for mtime, esize, path in sorted(entries):
+        if total <= size:
+            break
+        logging.debug("evict %r" % path)
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        total -= esize
+
+def refresh(config, force=False):
+    r"""Discard all content held in memory whose source files have changed
+    since it was loaded, so that the next call to chart() or all_transactions()
+    reloads only that content.  A long-running process (see abo.server) calls
+    this before every command.
+    """
+    global _chart, _base_chart, _chart_cache
+    dirty = [path for path, cache in _journals.items() if force or cache.is_dirty()]
+    for path in dirty:
+        logging.debug("refresh %r" % path)
+        del _journals[path]
+    if dirty:
+        _all_transactions.clear()
+    if _base_chart is not None and (force or _chart_cache.is_dirty()):
+        logging.debug("refresh %r" % config.chart_file_path)
+        _base_chart = _chart_cache = _chart = None
+    elif dirty and _chart is not None and not isinstance(_chart, Exception) and _chart.has_wild_account():
+        # The wild accounts instantiated by the changed journals must be
+        # discarded, so start again from the compiled chart.
+        _base_chart = _chart_cache = _chart = None
+
+def _reset():
+    global _chart_cache, _base_chart, _chart
+    _chart_cache = _base_chart = _chart = None
+    _all_transactions.clear()
+    _journals.clear()
+
+# Files in the cache directory that do not belong to any cache entry.
+_other_files = ('stats', 'stats.lock')
+
+def collect_garbage(config, tmp_age=3600):
+    r"""Remove every entry in the cache directory whose manifest is missing or
+    obsolete or names a source file that no longer exists, every filter output
+    that no remaining entry used, every aggregate value of sources that have
+    since changed, and any temporary file left by an interrupted write.  An
+    entry that another process is compiling, and a filter output or temporary
+    file written recently, is left alone.  Return the paths of all removed
+    files.
+    """
+    dirpath = config.cache_dir_path
+    try:
+        names = set(os.listdir(dirpath))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return []
+    removed = []
+    def remove(path):
+        try:
+            os.unlink(path)
+            removed.append(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    def is_old(path):
+        st = Cache.stat(path)
+        return st is not None and st.st_mtime < time.time() - tmp_age
+    filters = set()
+    for name in sorted(names):
+        path = os.path.join(dirpath, name)
+        if name.endswith('.tmp'):
+            if is_old(path):
+                remove(path)
+            continue
+        if name in _other_files or name.endswith('.lock') or name.endswith('.sock') or not os.path.isfile(path):
+            continue
+        cpath = path[:-len('.manifest')] if name.endswith('.manifest') else path
+        if cpath != path and os.path.basename(cpath) in names:
+            continue # will be visited as the content file
+        manifest = load_manifest(cpath + '.manifest')
+        if manifest is not None and all(os.path.exists(dep) for dep in manifest['deps']):
+            filters.update(manifest.get('filters', ()))
+            continue
+        with open(cpath + '.lock', 'a') as lockf:
+            try:
+                fcntl.flock(lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            remove(cpath)
+            remove(cpath + '.manifest')
+            remove(cpath + '.lock')
+    # Filter outputs and aggregate values have no manifests.  A filter output
+    # is written before the manifest of the journal that uses it, so is only
+    # removed once it is old.  Aggregate values are only kept for the current
+    # sources, if they are all compiled.
+    fp = _fingerprint(config, None, _chart_cache or ChartCache(config, None))
+    prefix = _aggregate_prefix(fp) if fp is not None else ''
+    for subdir, is_live in (('filter', lambda name, path: name in filters or not is_old(path)),
+                            ('aggregate', lambda name, path: name.startswith(prefix))):
+        try:
+            subnames = os.listdir(os.path.join(dirpath, subdir))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        for name in sorted(subnames):
+            path = os.path.join(dirpath, subdir, name)
+            if name.endswith('.tmp'):
+                if is_old(path):
+                    remove(path)
+            elif os.path.isfile(path) and not is_live(name, path):
+                remove(path)
+    return removed
+
+def statistics(config):
+    r"""Return the number of entries and total size in bytes of the cache
+    directory and of its aggregate values, and the counts of cache events
+    recorded in it.
+    """
+    dirpath = config.cache_dir_path
+    counts = Counter()
+    for subdir in ('', 'aggregate'):
+        try:
+            names = os.listdir(os.path.join(dirpath, subdir))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            names = []
+        for name in names:
+            path = os.path.join(dirpath, subdir, name)
+            st = Cache.stat(path)
+            if st is not None and os.path.isfile(path):
+                counts[subdir + 'size'] += st.st_size
+                if name.endswith('.manifest') or subdir:
+                    counts[subdir + 'entries'] += 1
+    flush_stats()
+    return struct(entries=counts['entries'],
+                  size=counts['size'],
+                  aggregates=counts['aggregateentries'],
+                  aggregate_size=counts['aggregatesize'],
+                  counts=read_stats(dirpath))
+
+def _test_book(**files):
+    # Return the config of a new account system in a temporary directory,
+    # containing the given files, with '_' in their names replaced by '.'.
+    import tempfile
+    base = tempfile.mkdtemp()
+    files.setdefault('_pyabo', 'journal *.jnl ;\ncache-dir cache ;\n')
+    files.setdefault('accounts', 'Food [food]\nBank [bank]\n')
+    for name, text in files.items():
+        with open(os.path.join(base, name.replace('_', '.')), 'w') as f:
+            f.write(text)
+    _reset()
+    return abo.config.Config().read_from(os.path.join(base, '.pyabo'))
+
+__test__ = {
+'manifest':r"""
+
+A journal is compiled once, and thereafter is clean until it changes:
+
+>>> config = _test_book(a_jnl='1/3/2013 something\n food  10.00\n bank\n')
+>>> path = config.journal_file_paths[0]
+>>> c = TransactionCache(config, None, path)
+>>> c.is_dirty()
+True
+>>> [t.amount() for t in c.get().transactions]
+[Money.AUD(10.00)]
+>>> TransactionCache(config, None, path).is_dirty()
+False
+
+A journal that is touched but not changed is not compiled again, and its new
+modification time is recorded, so that it is not digested again:
+
+>>> def touch(path, seconds):
+...     st = os.stat(path)
+...     os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 10**9))
+>>> touch(path, 10)
+>>> c = TransactionCache(config, None, path)
+>>> c.is_dirty()
+False
+>>> load_manifest(c.mpath)['deps'][path][0] == os.stat(path).st_mtime_ns
+True
+
+A journal whose content changes is compiled again, even if its size and
+modification time are unchanged:
+
+>>> st = os.stat(path)
+>>> with open(path, 'w') as f:
+...     _ = f.write('1/3/2013 something\n food  20.00\n bank\n')
+>>> os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+>>> c = TransactionCache(config, None, path)
+>>> c.is_dirty()
+True
+>>> [t.amount() for t in c.get().transactions]
+[Money.AUD(20.00)]
+>>> TransactionCache(config, None, path).is_dirty()
+False
+>>> with open(path, 'a') as f:
+...     _ = f.write('\n')
+>>> TransactionCache(config, None, path).is_dirty()
+True
+
+""",
+'lock':r"""
+
+A process that finds a journal dirty waits for the lock on its cache entry,
+then checks it again, so that if another process compiled it in the meantime,
+its content is loaded instead of compiled again:
+
+>>> import abo.cache
+>>> config = _test_book(a_jnl='1/3/2013 something\n food  10.00\n bank\n')
+>>> path = config.journal_file_paths[0]
+>>> c = TransactionCache(config, None, path)
+>>> def compiled_meanwhile():
+...     del c.is_dirty
+...     TransactionCache(config, None, path).compile()
+...     return True
+>>> c.is_dirty = compiled_meanwhile
+>>> _ = base_chart(config)
+>>> before = Counter(abo.cache._stats)
+>>> [t.amount() for t in c.get().transactions]
+[Money.AUD(10.00)]
+>>> sorted((abo.cache._stats - before).items())
+[('compiled', 1), ('loaded', 1), ('waited', 1)]
+
+""",
+'atomic':r"""
+
+A file written by atomic_open() is replaced only if writing completes:
+
+>>> import tempfile
+>>> dirpath = tempfile.mkdtemp()
+>>> path = os.path.join(dirpath, 'file')
+>>> with atomic_open(path) as f:
+...     _ = f.write(b'complete')
+>>> try:
+...     with atomic_open(path) as f:
+...         _ = f.write(b'partial')
+...         raise ValueError('interrupted')
+... except ValueError:
+...     pass
+>>> os.listdir(dirpath), open(path, 'rb').read()
+(['file'], b'complete')
+
+""",
+'gc':r"""
+
+The statistics of a cache directory count its entries, here the chart and two
+journals, and the events recorded by all processes that used it:
+
+>>> import abo.cache
+>>> config = _test_book(a_jnl='1/3/2013 something\n food  10.00\n bank\n',
+...               b_jnl='2/3/2013 another\n food  20.00\n bank\n')
+>>> a, b = (os.path.join(config.base_dir_path, name) for name in ('a.jnl', 'b.jnl'))
+>>> flush_stats()
+>>> for path in a, b, a:
+...     _ = TransactionCache(config, None, path).get()
+>>> s = statistics(config)
+>>> s.entries, s.size > 0, s.aggregates, s.aggregate_size
+(3, True, 0, 0)
+>>> sorted(s.counts.items())
+[('compiled', 3), ('loaded', 1)]
+
+Garbage collection removes the entries of journals that no longer exist,
+files that belong to no entry, and stale temporary files, but keeps live
+entries and recent temporary files, which may still be being written:
+
+>>> os.unlink(b)
+>>> for name, age in ('orphan', 0), ('x.1.tmp', 7200), ('y.1.tmp', 0):
+...     path = os.path.join(config.cache_dir_path, name)
+...     open(path, 'w').close()
+...     os.utime(path, (time.time() - age,) * 2)
+>>> [os.path.basename(path) for path in collect_garbage(config)]
+['b.jnl', 'b.jnl.manifest', 'b.jnl.lock', 'orphan', 'orphan.lock', 'x.1.tmp']
+>>> sorted(os.listdir(config.cache_dir_path)) #doctest: +NORMALIZE_WHITESPACE
+['a.jnl', 'a.jnl.lock', 'a.jnl.manifest', 'accounts', 'accounts.lock', 'accounts.manifest',
+ 'stats', 'stats.lock', 'y.1.tmp']
+>>> [t.amount() for t in TransactionCache(config, None, a).get().transactions]
+[Money.AUD(10.00)]
+>>> collect_garbage(config)
+[]
+
+Filter outputs are kept while a journal's entry used them, and aggregate values
+while their sources are unchanged:
+
+>>> config = _test_book(a_jnl='%filter sed /^%/d\n1/3/2013 something\n food  10.00\n bank\n')
+>>> path = config.journal_file_paths[0]
+>>> [t.what for t in all_transactions(config)]
+['something']
+>>> aggregate(config, None, ('total',), lambda: 10)
+10
+>>> with open(path, 'a') as f:
+...     _ = f.write('\n2/3/2013 another\n food  20.00\n bank\n')
+>>> refresh(config)
+>>> [t.what for t in all_transactions(config)]
+['something', 'another']
+>>> aggregate(config, None, ('total',), lambda: 30)
+30
+>>> filterdir = os.path.join(config.cache_dir_path, 'filter')
+>>> open(os.path.join(filterdir, 'orphan'), 'w').close()
+>>> for name in os.listdir(filterdir):
+...     os.utime(os.path.join(filterdir, name), (time.time() - 7200,) * 2)
+>>> [os.path.relpath(path, config.cache_dir_path) for path in collect_garbage(config)] #doctest: +ELLIPSIS
+['filter/orphan', 'aggregate/...']
+>>> len(os.listdir(filterdir)), len(os.listdir(os.path.join(config.cache_dir_path, 'aggregate')))
+(1, 1)
+>>> aggregate(config, None, ('total',), lambda: 0)
+30
+
+""",
+'aggregate':r"""
+
+An aggregate value is computed only if it is not cached for the current
+content of the chart and all journals:
+
+>>> config = _test_book(a_jnl='1/3/2013 something\n food  10.00\n bank\n')
+>>> path = config.journal_file_paths[0]
+>>> calls = []
+>>> def total():
+...     calls.append(None)
+...     return sum(t.amount() for t in all_transactions(config))
+>>> fingerprint(config) is None
+True
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(10.00), 1)
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(10.00), 1)
+>>> aggregate(config, None, ('another',), total), len(calls)
+(Money.AUD(10.00), 2)
+
+Once a journal changes, the value cached for its old content is stale, so is
+computed again:
+
+>>> with open(path, 'w') as f:
+...     _ = f.write('1/3/2013 something\n food  20.00\n bank\n')
+>>> refresh(config)
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(20.00), 3)
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(20.00), 3)
+
+A caller that looks up many values can take the fingerprint once and use it
+for all of them:
+
+>>> fp = fingerprint(config)
+>>> load_aggregate(config, ('total',), fp)
+Money.AUD(20.00)
+>>> load_aggregate(config, ('count',), fp) is None
+True
+>>> save_aggregate(config, ('count',), fp, 1)
+>>> load_aggregate(config, ('count',), fp)
+1
+
+Nothing is cached if the sources are not compiled:
+
+>>> dirpath = os.path.join(config.cache_dir_path, 'aggregate')
+>>> len(os.listdir(dirpath))
+4
+>>> _reset()
+>>> aggregate(config, None, ('constant',), lambda: 1)
+1
+>>> len(os.listdir(dirpath))
+4
+
+When the aggregate values outgrow the given size, the least recently used are
+evicted first, and loading a value makes it the most recently used:
+
+>>> _ = base_chart(config)
+>>> for name in os.listdir(dirpath):
+...     os.utime(os.path.join(dirpath, name), (time.time() - 60,) * 2)
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(20.00), 3)
+>>> latest = max(os.listdir(dirpath), key=lambda name: os.stat(os.path.join(dirpath, name)).st_mtime)
+>>> evict_aggregates(dirpath, size=os.stat(os.path.join(dirpath, latest)).st_size)
+>>> os.listdir(dirpath) == [latest]
+True
+>>> aggregate(config, None, ('total',), total), len(calls)
+(Money.AUD(20.00), 3)
+>>> for name, age in ('a', 30), ('b', 20), ('c', 10), ('d.1.tmp', 40):
+...     with open(os.path.join(dirpath, name), 'wb') as f:
+...         _ = f.write(b'x' * 100)
+...     os.utime(os.path.join(dirpath, name), (time.time() - age,) * 2)
+>>> os.unlink(os.path.join(dirpath, latest))
+>>> evict_aggregates(dirpath, size=250)
+>>> sorted(os.listdir(dirpath))
+['b', 'c', 'd.1.tmp']
+>>> evict_aggregates(dirpath, size=100)
+>>> sorted(os.listdir(dirpath))
+['c', 'd.1.tmp']
+
+""",
+'wild':r"""
+
+The wild accounts of a chart are instantiated from the names recorded in the
+manifests of compiled journals, without loading their transactions:
+
+>>> config = _test_book(accounts='Food [food]\nBank [bank]\nDebtors [debtors]\n  *\n',
+...                     a_jnl='1/3/2013 invoice\n debtors:Alice  10.00\n food\n')
+>>> journal = config.journal_file_paths[0]
+>>> c = TransactionCache(config, None, journal)
+>>> c.get().wild_names, load_manifest(c.mpath)['wild_names']
+([':Debtors:Alice'], [':Debtors:Alice'])
+>>> _reset()
+>>> chart(config)['debtors:Alice'].full_name()
+':Debtors:Alice'
+>>> _all_transactions
+{}
+
+If any journal is not compiled, all are loaded:
+
+>>> with open(journal, 'a') as f:
+...     _ = f.write('\n2/3/2013 invoice\n debtors:Bob  20.00\n food\n')
+>>> _reset()
+>>> sorted(a.full_name() for a in chart(config).substantial_accounts())
+[':Bank', ':Debtors:Alice', ':Debtors:Bob', ':Food']
+>>> len(all_transactions(config))
+2
+
+""",
+'freeze':r"""
+
+A frozen journal is loaded from its snapshot, even if its text is removed,
+and thawing it regenerates text that parses into the same transactions:
+
+>>> config = _test_book(a_jnl='1/3/2013 Somebody; something =one =two\n'
+...                           ' food  10.00 ; a detail\n'
+...                           ' bank ; {30/4/2013}\n'
+...                           '\n'
+...                           '2/3/2013 another thing\n'
+...                           ' food  -2.50\n'
+...                           ' bank\n')
+>>> path = config.journal_file_paths[0]
+>>> before = list(map(_transaction_fields, all_transactions(config)))
+>>> freeze(config, None, path)
+2
+>>> freeze(config, None, path) #doctest: +ELLIPSIS
+Traceback (most recent call last):
+abo.cache.ContentError: ...: already frozen
+>>> os.unlink(path)
+>>> _reset()
+>>> list(map(_transaction_fields, all_transactions(config))) == before
+True
+>>> thaw(config, None, path)
+True
+>>> os.path.exists(path + abo.config.FROZEN_SUFFIX)
+False
+>>> _reset()
+>>> list(map(_transaction_fields, all_transactions(config))) == before
+True
+>>> date, edate, who, what, tags, is_projection, entries = before[0]
+>>> date, edate, who, what, sorted(tags), is_projection
+(datetime.date(2013, 3, 1), datetime.date(2013, 3, 1), 'Somebody', 'something', ['one', 'two'], False)
+>>> entries #doctest: +NORMALIZE_WHITESPACE
+(Entry(account=':Bank', amount=Money.AUD(-10.00), cdate=datetime.date(2013, 4, 30)),
+ Entry(account=':Food', amount=Money.AUD(10.00), detail='a detail'))
+
+Thawing refuses to discard edits made to the text since it was frozen:
+
+>>> freeze(config, None, path)
+2
+>>> with open(path, 'a') as f:
+...     _ = f.write('\n3/3/2013 yet another\n food  1.00\n bank\n')
+>>> thaw(config, None, path) #doctest: +ELLIPSIS
+Traceback (most recent call last):
+abo.cache.ContentError: ...: changed since it was frozen; move it aside to regenerate it
+>>> os.path.exists(path + abo.config.FROZEN_SUFFIX)
+True
+
+""",
+}
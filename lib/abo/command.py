@@ -12,13 +12,16 @@ import datetime
 from itertools import chain
 from collections import defaultdict
 
+import abo.config
 import abo.cache
 import abo.account
 import abo.journal
+import abo.money
 import abo.period
 import abo.transaction
 from abo.transaction import sign
 import abo.balance
+import abo.timing
 from abo.types import struct
 from abo.config import InvalidArg, InvalidOption
 
@@ -40,8 +43,9 @@ def cmd_journal(config, opts):
     yield ''
     yield fmt % ('Date', 'Particulars', 'Amount', 'DC', 'Account')
     yield fmt % ('-' * dw, '-' * pw, '-' * bw, '--', '-' * aw)
+    format_money = config.money_formatter()
     def entry_fields(e):
-        return (config.format_money(abs(e.amount)), ('db' if e.amount < 0 else 'cr'), chart[e.account].short_name())
+        return (format_money(abs(e.amount)), ('db' if e.amount < 0 else 'cr'), e.resolve(chart).short_name())
     if bf:
         for e in sorted(bf.entries(), key=lambda e: (e.cdate or datetime.date.min, e.amount, e.account)):
             yield fmt % (('',
@@ -98,15 +102,16 @@ def cmd_acc(config, opts):
     datekey = transaction_datekey(config, opts)
     range, bf, transactions = filter_period(chart, all_transactions, opts)
     if opts['--control']:
-        entries = [e for e in chain(*(t.entries for t in all_transactions)) if chart[e.account] in accounts and (e.cdate or datekey(e.transaction)[0]) in range]
+        entries = [e for e in chain(*(t.entries for t in all_transactions)) if e.resolve(chart) in accounts and (e.cdate or datekey(e.transaction)[0]) in range]
         entries.sort(key=lambda e: ((e.cdate,) if e.cdate else tuple()) + datekey(e.transaction))
     else:
-        entries = [e for e in chain(*(t.entries for t in transactions)) if chart[e.account] in accounts]
+        entries = [e for e in chain(*(t.entries for t in transactions)) if e.resolve(chart) in accounts]
     if opts['--omit-empty'] and not entries:
         return
     dw = 11
     mw = config.money_column_width()
     bw = config.balance_column_width()
+    format_money = config.money_formatter()
     width, pw = config.get_output_widths((8, 35, None), section='acc', fixed=dw + 2 + 2 * (mw + 1) + 1 + bw)
     fmt = '%-{dw}.{dw}s  %-{pw}.{pw}s %{mw}s %{mw}s %{bw}s'.format(**locals())
     if not opts['--bare']:
@@ -137,15 +142,15 @@ def cmd_acc(config, opts):
                                                  width=pw)
                             yield fmt % ('',
                                          text.pop(0) if text else '',
-                                         config.format_money(-amount) if amount < 0 else '',
-                                         config.format_money(amount) if amount > 0 else '',
-                                         config.format_money(tally.balance))
+                                         format_money(-amount) if amount < 0 else '',
+                                         format_money(amount) if amount > 0 else '',
+                                         format_money(tally.balance))
                             if opts['--wrap']:
                                 while text:
                                     yield fmt % ('', text.pop(0), '', '', '')
                     else:
                         for e in sorted(bf.entries(), key=lambda e: (e.cdate or datetime.date.min, e.amount, e.account)):
-                            if chart[e.account] is account and e.amount != 0:
+                            if e.resolve(chart) is account and e.amount != 0:
                                 tally.balance += e.amount
                                 text = textwrap.wrap('; '.join(filter(bool, ['Brought forward',
                                                                              'due ' + e.cdate.strftime(r'%-d-%b-%Y') if e.cdate else '',
@@ -153,9 +158,9 @@ def cmd_acc(config, opts):
                                                      width=pw)
                                 yield fmt % ('',
                                              text.pop(0) if text else '',
-                                             config.format_money(-e.amount) if e.amount < 0 else '',
-                                             config.format_money(e.amount) if e.amount > 0 else '',
-                                             config.format_money(tally.balance))
+                                             format_money(-e.amount) if e.amount < 0 else '',
+                                             format_money(e.amount) if e.amount > 0 else '',
+                                             format_money(tally.balance))
                                 if opts['--wrap']:
                                     while text:
                                         yield fmt % ('', text.pop(0), '', '', '')
@@ -165,7 +170,7 @@ def cmd_acc(config, opts):
             for line in lines:
                 yield line
     for entry in entries:
-        acc = chart[entry.account]
+        acc = entry.resolve(chart)
         adate = datekey(entry.transaction)[0]
         date = entry.cdate if opts['--control'] and entry.cdate else adate
         tally.balance += entry.amount
@@ -208,30 +213,30 @@ def cmd_acc(config, opts):
         desc = textwrap.wrap(desc, width=pw)
         yield fmt % (date.strftime(r'%_d-%b-%Y'),
                 desc.pop(0) if desc else '',
-                config.format_money(-entry.amount) if entry.amount < 0 else '',
-                config.format_money(entry.amount) if entry.amount > 0 else '',
-                config.format_money(tally.balance))
+                format_money(-entry.amount) if entry.amount < 0 else '',
+                format_money(entry.amount) if entry.amount > 0 else '',
+                format_money(tally.balance))
         if opts['--wrap']:
             while desc:
                 yield fmt % ('', desc.pop(0), '', '', '')
     yield fmt % ('-' * dw, '-' * pw, '-' * mw, '-' * mw, '-' * bw)
     yield fmt % ('', 'Totals for period',
-            config.format_money(-tally.totdb),
-            config.format_money(tally.totcr),
+            format_money(-tally.totdb),
+            format_money(tally.totcr),
             '')
-    yield fmt % ('', 'Balance', '', '', config.format_money(tally.balance))
+    yield fmt % ('', 'Balance', '', '', format_money(tally.balance))
 
 def invoice_bill_account(chart, transaction):
     # Treat this transaction as an invoice, bill, remittance or payment if all
     # its debits OR all its credits are to a single accrual (payable/receivable)
     # account.
-    accrual_entry = next((e for e in transaction.entries if chart[e.account].is_accrual()), None)
+    accrual_entry = next((e for e in transaction.entries if e.resolve(chart).is_accrual()), None)
     if accrual_entry is None:
         return None
     accrual_account = chart[accrual_entry.account]
     accrual_sign = sign(accrual_entry.amount)
     for e in transaction.entries:
-        acc = chart[e.account]
+        acc = e.resolve(chart)
         if acc.is_accrual():
             if acc is not accrual_account or sign(e.amount) != accrual_sign:
                 return None
@@ -260,6 +265,7 @@ class Formatter(object):
         self.num_columns = ncolumns
         self.labelwid = max(chain([8], (len(a.label or '') for a in accounts)))
         self.balwid = self.config.balance_column_width()
+        self.format_money = self.config.money_formatter()
         if self.config.width:
             maxaw = None
         elif self.opt_fullnames:
@@ -346,7 +352,7 @@ class Formatter(object):
             for acol in amount_columns:
                 if (account is None or self.opt_subtotals or not is_subaccount) and account in acol:
                     amount = acol[account]
-                    columns.append(self.config.format_money(amount) if amount or not self.elide_zero else '')
+                    columns.append(self.format_money(amount) if amount or not self.elide_zero else '')
                 else:
                     columns.append('')
             yield self.fmt(text + ' ', ((' ' + c if c else '') for c in columns),
@@ -397,15 +403,11 @@ def cmd_profloss(config, opts):
         )
     ranges = parse_ranges(opts)
     chart = get_chart(config, opts)
-    transactions = get_transactions(chart, config, opts)
+    transactions = lazy_transactions(chart, config, opts)
     selectpred = select_option_predicate(chart, opts)
-    plpred = lambda e: chart[e.account].is_profitloss()
-    balances = [abo.balance.Balance(transactions,
-                                    date_range=r,
-                                    chart=chart,
-                                    entry_pred=lambda e: plpred(e) and selectpred(e),
-                                    use_edate=opts['--effective'])
-                                for r in ranges]
+    plpred = lambda e: e.resolve(chart).is_profitloss()
+    balances = get_balances(config, opts, chart, 'profloss', ranges, transactions,
+                            entry_pred=lambda e: plpred(e) and selectpred(e))
     make_sections(sections, balances)
     all_accounts = set(chain(*(s.accounts for s in sections)))
     f = Formatter(config, 'profloss', opts, all_accounts, len(balances))
@@ -436,29 +438,19 @@ def cmd_cashflow(config, opts):
         )
     ranges = parse_ranges(opts)
     chart = get_chart(config, opts)
-    transactions = get_transactions(chart, config, opts)
+    all_transactions = lazy_transactions(chart, config, opts)
     selectpred = select_option_predicate(chart, opts)
-    cashpred = lambda e: chart[e.account].is_tagged(chart, 'cash')
+    cashpred = lambda e: e.resolve(chart).is_tagged(chart, 'cash')
     noncashpred = lambda e: not cashpred(e)
-    transactions = abo.account.remove_account(chart, lambda a: not a.is_tagged(chart, 'cash'), transactions, cancel_only=True)
-    cash_balances = [struct(open=abo.balance.Balance(transactions,
-                                                     date_range=r.preceding(),
-                                                     chart=chart,
-                                                     entry_pred=lambda e: cashpred(e) and selectpred(e),
-                                                     use_edate=opts['--effective']),
-                            close=abo.balance.Balance(transactions,
-                                                      date_range=r.following().preceding(),
-                                                      chart=chart,
-                                                      entry_pred=lambda e: cashpred(e) and selectpred(e),
-                                                      use_edate=opts['--effective']))
-                     for r in ranges]
-    non_cash_balances = [abo.balance.Balance(transactions,
-                                             date_range=r,
-                                             chart=chart,
-                                             entry_pred=lambda e: noncashpred(e) and selectpred(e),
-                                             acc_map=abo.account.Account.report_account,
-                                             use_edate=opts['--effective'])
-                                        for r in ranges]
+    transactions = lazy(lambda: abo.account.remove_account(chart, lambda a: not a.is_tagged(chart, 'cash'), all_transactions(), cancel_only=True))
+    cash_ranges = [r.preceding() for r in ranges] + [r.following().preceding() for r in ranges]
+    cash = get_balances(config, opts, chart, 'cashflow cash', cash_ranges, transactions,
+                        entry_pred=lambda e: cashpred(e) and selectpred(e))
+    cash_balances = [struct(open=open_balance, close=close_balance)
+                     for open_balance, close_balance in zip(cash[:len(ranges)], cash[len(ranges):])]
+    non_cash_balances = get_balances(config, opts, chart, 'cashflow', ranges, transactions,
+                                     entry_pred=lambda e: noncashpred(e) and selectpred(e),
+                                     acc_map=abo.account.Account.report_account)
     make_sections(sections, non_cash_balances)
     all_accounts = set(chain(*(s.accounts for s in sections)))
     f = Formatter(config, 'cashflow', opts, all_accounts, len(non_cash_balances), minaw=19, elide_zero=True)
@@ -492,15 +484,13 @@ def cmd_bsheet(config, opts):
     )
     chart = get_chart(config, opts)
     retained = chart.get_or_create(name='retained profit(-loss)', atype=abo.account.AccountType.Equity)
-    all_transactions = get_transactions(chart, config, opts)
+    all_transactions = lazy_transactions(chart, config, opts)
     ranges = parse_whens(opts)
     selectpred = select_option_predicate(chart, opts)
-    notplpred = lambda e: not plpred(chart[e.account])
-    balances = [abo.balance.Balance(all_transactions, date_range=r, chart=chart,
-                                    entry_pred=lambda e: notplpred(e) and selectpred(e),
-                                    acc_map=lambda a: retained if plpred(a) else a.report_account(),
-                                    use_edate=opts['--effective'])
-                for r in ranges]
+    notplpred = lambda e: not plpred(e.resolve(chart))
+    balances = get_balances(config, opts, chart, 'bsheet', ranges, all_transactions,
+                            entry_pred=lambda e: notplpred(e) and selectpred(e),
+                            acc_map=lambda a: retained if plpred(a) else a.report_account())
     make_sections(sections, balances)
     all_accounts = set(chain(*(s.accounts for s in sections)))
     f = Formatter(config, 'bsheet', opts, all_accounts, len(balances))
@@ -518,23 +508,18 @@ def cmd_bsheet(config, opts):
 
 def cmd_balance(config, opts):
     chart = get_chart(config, opts)
-    all_transactions = get_transactions(chart, config, opts)
+    all_transactions = lazy_transactions(chart, config, opts)
     ranges = parse_whens(opts)
     selectpred = select_option_predicate(chart, opts)
-    balances = [abo.balance.Balance(all_transactions,
-                                    date_range=r,
-                                    chart=chart,
-                                    entry_pred=selectpred,
-                                    use_edate=opts['--effective'])
-                                for r in ranges]
+    balances = get_balances(config, opts, chart, 'balance', ranges, all_transactions, entry_pred=selectpred)
     if opts['--journal']:
         for b in balances:
             yield ''
             yield b.date_range.last.strftime(r'%-d/%-m/%Y') + ' balance'
             balance_check = 0
-            for e in sorted((e for e in b.entries() if chart[e.account].is_substantial()), key=lambda e: (chart[e.account].short_name(), e.cdate or datetime.date.min, e.amount)):
+            for e in sorted((e for e in b.entries() if e.resolve(chart).is_substantial()), key=lambda e: (e.resolve(chart).short_name(), e.cdate or datetime.date.min, e.amount)):
                 balance_check += e.amount
-                yield (' ' + chart[e.account].short_name()
+                yield (' ' + e.resolve(chart).short_name()
                            + '  ' + config.format_money(e.amount, symbol=False, thousands=False)
                            + (e.cdate.strftime(r' ; {%-d/%-m/%Y}') if e.cdate is not None else ''))
             assert balance_check == 0, 'balance_check = %s' % balance_check
@@ -556,15 +541,15 @@ def cmd_balance(config, opts):
         line.append('Account')
         yield fmt % tuple(line)
         yield fmt % (('-' * bw,) * len(balances) + ('-' * aw,))
-        balance_check = defaultdict(lambda: 0)
+        columns = range(len(balances))
+        balance_check = abo.money.MoneyVector(len(balances))
         for account in display_accounts:
             amts = [b.balance(account) for b in balances]
             if opts['--all'] or list(filter(bool, amts)):
                 yield fmt % (tuple(config.format_money(bal) for bal in amts) + (str(account),))
-                for b, amt in zip(balances, amts):
-                    balance_check[b] += amt
+                balance_check.scatter_add(columns, amts)
         yield fmt % (('-' * bw,) * len(balances) + ('-' * aw,))
-        yield fmt % (tuple(config.format_money(bal) for bal in balance_check.values()) + ('BALANCE',))
+        yield fmt % (tuple(config.format_money_vector(balance_check)) + ('BALANCE',))
 
 def compute_due_accounts(chart, transactions, entry_pred=None):
     due_accounts = set()
@@ -572,7 +557,7 @@ def compute_due_accounts(chart, transactions, entry_pred=None):
     for t in transactions:
         for e in t.entries:
             if entry_pred is None or entry_pred(e):
-                account = chart[e.account]
+                account = e.resolve(chart)
                 if account.is_accrual():
                     account = account.accrual_parent()
                     due_accounts.add(account)
@@ -621,7 +606,7 @@ def cmd_due(config, opts):
         if opts['--over'] and date >= datetime.date.today():
             continue
         for e in due.entries:
-            assert chart[e.account] in due.account, 'e.account=%r account=%r' % (chart[e.account], due.account)
+            assert e.resolve(chart) in due.account, 'e.account=%r account=%r' % (e.resolve(chart), due.account)
         balance = sum(e.amount for e in due.entries)
         details = []
         if opts['--detail']:
@@ -651,8 +636,8 @@ def cmd_table(config, opts):
     slot_headings = ['1+ year',    '6+ months',    '3+ months',    '2+ months',    '1+ month',    '< 1 month', 'future']
     slot_whens =    ['1 year ago', '6 months ago', '3 months ago', '2 months ago', '1 month ago', 'today']
     slot_dates = [abo.period.parse_when(when.split()) for when in slot_whens]
-    table = defaultdict(lambda: [0] * len(slot_headings))
-    totals = [0] * len(slot_headings)
+    table = defaultdict(lambda: abo.money.MoneyVector(len(slot_headings)))
+    totals = abo.money.MoneyVector(len(slot_headings))
     usedcols = [False] * len(slot_headings)
     accounts = []
     accountset = set()
@@ -661,23 +646,19 @@ def cmd_table(config, opts):
             continue
         slot = next((i for i, sdate in enumerate(slot_dates) if date <= sdate), len(slot_dates))
         for e in due.entries:
-            assert chart[e.account] in due.account, 'e.account=%r account=%r' % (chart[e.account], due.account)
-            table[due.account][slot] += e.amount
-            totals[slot] += e.amount
+            assert e.resolve(chart) in due.account, 'e.account=%r account=%r' % (e.resolve(chart), due.account)
+            table[due.account].add(slot, e.amount)
+            totals.add(slot, e.amount)
             usedcols[slot] = True
         if due.account not in accountset:
             accounts.append(due.account)
             accountset.add(due.account)
     # Remove empty columns
-    slot = 0
-    for used in usedcols:
-        if not used:
-            del slot_headings[slot]
-            for account, tablerow in table.items():
-                del tablerow[slot]
-            del totals[slot]
-        else:
-            slot += 1
+    used = [slot for slot, u in enumerate(usedcols) if u]
+    slot_headings = [slot_headings[slot] for slot in used]
+    for account, tablerow in table.items():
+        table[account] = tablerow.gather(used)
+    totals = totals.gather(used)
     # Print the table
     bw = config.money_column_width()
     fmt = ('%{bw}s ' * len(slot_headings) + ' %s').format(**locals())
@@ -686,10 +667,10 @@ def cmd_table(config, opts):
         yield fmt % (('-' * bw,) * len(slot_headings) + ('',))
     for account in accounts:
         name = account.label if opts['--labels'] and account.label else str(account)
-        yield fmt % (tuple(config.format_money(amt) if amt else '-  ' for amt in table[account]) + (name,))
+        yield fmt % (tuple(config.format_money_vector(table[account], zero='-  ')) + (name,))
     if not opts['--bare']:
         yield fmt % (('-' * bw,) * len(slot_headings) + ('',))
-        yield fmt % (tuple(config.format_money(amt) if amt else '-  ' for amt in totals) + ('',))
+        yield fmt % (tuple(config.format_money_vector(totals, zero='-  ')) + ('',))
 
 def cmd_check(config, opts):
     bw = max(8, config.balance_column_width())
@@ -706,11 +687,11 @@ def cmd_check(config, opts):
             balance = abo.balance.Balance(all_transactions, date_range=date_range, chart=chart, use_edate=opts['--effective'])
             be = defaultdict(lambda: dict())
             for e in balance.entries():
-                be[chart[e.account]][e.cdate] = e.amount
+                be[e.resolve(chart)][e.cdate] = e.amount
             ce = defaultdict(lambda: dict())
             for e in t.entries:
                 try:
-                    ce[chart[e.account]][e.cdate] = e.amount
+                    ce[e.resolve(chart)][e.cdate] = e.amount
                 except abo.account.AccountKeyError:
                     yield ('   ' + 'no account'.rjust(bw + 3) + ' ' + format_entry(e.account))
             accounts = frozenset(be) | frozenset(ce)
@@ -754,6 +735,49 @@ def cmd_mako(config, opts):
     ret.sep = ''
     return ret
 
+def cmd_cache(config, opts):
+    if opts['gc']:
+        for path in abo.cache.collect_garbage(config):
+            yield 'removed ' + path
+    elif opts['stats']:
+        stats = abo.cache.statistics(config)
+        counts = stats.counts
+        def rate(hits, misses):
+            return '%.1f%%' % (100.0 * hits / (hits + misses)) if hits + misses else '-'
+        fmt = '%-19s %s'
+        yield fmt % ('directory', os.path.abspath(config.cache_dir_path))
+        yield fmt % ('entries', stats.entries)
+        yield fmt % ('size', '%u bytes' % stats.size)
+        for event in ('loaded', 'compiled', 'touched', 'waited'):
+            yield fmt % (event, counts[event])
+        yield fmt % ('hit rate', rate(counts['loaded'], counts['compiled']))
+        yield fmt % ('aggregates', stats.aggregates)
+        yield fmt % ('aggregate size', '%u bytes' % stats.aggregate_size)
+        yield fmt % ('aggregates loaded', counts['aggregate_loaded'])
+        yield fmt % ('aggregates computed', counts['aggregate_compiled'])
+        yield fmt % ('aggregate hit rate', rate(counts['aggregate_loaded'], counts['aggregate_compiled']))
+        yield fmt % ('filter runs avoided', counts['filter_avoided'])
+
+def journal_paths(config, opts):
+    paths = [os.path.abspath(path) for path in config.journal_file_paths]
+    for arg in opts['<journal>']:
+        path = os.path.abspath(arg)
+        if path not in paths:
+            raise InvalidArg('<journal>', 'not a journal: %r' % arg)
+        yield path
+
+def cmd_freeze(config, opts):
+    for path in list(journal_paths(config, opts)):
+        n = abo.cache.freeze(config, opts, path)
+        yield 'froze %u transactions in %s' % (n, os.path.relpath(path + abo.config.FROZEN_SUFFIX))
+
+def cmd_thaw(config, opts):
+    for path in list(journal_paths(config, opts)):
+        if abo.cache.thaw(config, opts, path):
+            yield 'thawed %s' % os.path.relpath(path)
+        else:
+            yield 'thawed %s (unchanged)' % os.path.relpath(path)
+
 def get_chart(config, opts):
     return abo.cache.chart(config, opts)
 
@@ -763,13 +787,14 @@ def transaction_datekey(config, opts):
 def get_transactions(chart, config, opts):
     transactions = abo.cache.all_transactions(config, opts)
     if opts['--projection']:
-        transactions += pay_when_due(chart, transactions)
+        transactions = transactions + pay_when_due(chart, transactions)
     else:
         transactions = [t for t in transactions if not t.is_projection]
     if opts['--reduce']:
         transactions = [t.reduce() for t in transactions]
     datekey = transaction_datekey(config, opts)
-    transactions.sort(key=lambda t: datekey(t) + (t.who or '', t.what or '', -t.amount()))
+    with abo.timing.phase('sort'):
+        transactions.sort(key=lambda t: datekey(t) + (t.who or '', t.what or '', -t.amount()))
     if opts['--remove']:
         for text in opts['--remove']:
             try:
@@ -779,6 +804,48 @@ def get_transactions(chart, config, opts):
             transactions = abo.account.remove_account(chart, pred, transactions)
     return transactions
 
+def lazy(func):
+    r"""Return a function that returns the result of func(), only calling it
+    the first time.
+    """
+    result = []
+    def call():
+        if not result:
+            result.append(func())
+        return result[0]
+    return call
+
+def lazy_transactions(chart, config, opts):
+    return lazy(lambda: get_transactions(chart, config, opts))
+
+def get_balances(config, opts, chart, purpose, ranges, transactions, **kwargs):
+    r"""Return a Balance for each of the given ranges of the transactions
+    returned by transactions(), which is only called if the tallies for a
+    range with the same purpose and options are not in the aggregate cache.
+    The ranges not in the cache are tallied together, in a single pass over
+    the transactions.
+    """
+    key = (purpose,
+           opts['--select'],
+           tuple(opts['--remove'] or ()),
+           bool(opts['--effective']),
+           bool(opts['--projection']),
+           bool(opts['--reduce']))
+    ranges = list(ranges)
+    keys = [key + (r.key(),) for r in ranges]
+    fp = abo.cache.fingerprint(config, opts)
+    tallies = [abo.cache.load_aggregate(config, k, fp) for k in keys]
+    missing = [i for i, t in enumerate(tallies) if t is None]
+    if missing:
+        multi = abo.balance.MultiBalance(transactions(), [ranges[i] for i in missing], chart=chart, use_edate=opts['--effective'], **kwargs)
+        # Tallying may have compiled the sources, so only now are they known to
+        # be unchanged since the tallies were made.
+        fp = abo.cache.fingerprint(config, opts)
+        for i, balance in zip(missing, multi):
+            tallies[i] = balance.raw_tallies()
+            abo.cache.save_aggregate(config, keys[i], fp, tallies[i])
+    return [abo.balance.Balance.from_raw_tallies(t, date_range=r, chart=chart) for t, r in zip(tallies, ranges)]
+
 def pay_when_due(chart, transactions):
     projected = []
     if 'proj' in chart:
@@ -15,6 +15,9 @@ from itertools import chain
 import sys
 import copy
 
+# The suffix of the file that holds the snapshot of a frozen journal.
+FROZEN_SUFFIX = '.frozen'
+
 class InvalidInput(ValueError):
 
     def __init__(self, label, cause=None):
@@ -71,6 +74,8 @@ class Config(object):
         self.width = None
         self.maximum_output_width = {}
         self.cache_dir_path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'abo')
+        self.cache_format = 'pickle'
+        self._money_column_width = None
         text = os.environ.get('ABO_WIDTH')
         if text is not None:
             try:
@@ -118,12 +123,20 @@ class Config(object):
             parser.add_keyword('heading', self._set_heading)
             parser.add_keyword('checkpoint', self._set_checkpoint)
             parser.add_keyword('cache-dir', self._set_cache_dir)
+            parser.add_keyword('cache-format', self._set_cache_format)
             parser.add_section_keyword('maximum-output-width', self._set_maximum_output_width)
             parser.parse()
         return self
 
     def _set_journal(self, parser, word):
-        self.journal_file_paths += glob.glob(os.path.join(parser.basedir, word))
+        pattern = os.path.join(parser.basedir, word)
+        paths = glob.glob(pattern)
+        # A frozen journal need not have its text (see abo.cache.freeze()).
+        for path in glob.glob(pattern + FROZEN_SUFFIX):
+            path = path[:-len(FROZEN_SUFFIX)]
+            if path not in paths:
+                paths.append(path)
+        self.journal_file_paths += paths
 
     def _set_heading(self, parser, word):
         if self.heading is not None:
@@ -136,6 +149,13 @@ class Config(object):
     def _set_cache_dir(self, parser, word):
         self.cache_dir_path = os.path.join(self.base_dir_path, word)
 
+    cache_formats = ('pickle', 'columnar')
+
+    def _set_cache_format(self, parser, word):
+        if word not in self.cache_formats:
+            raise ConfigException("invalid cache format %r, expecting one of: %s" % (word, ', '.join(self.cache_formats)))
+        self.cache_format = word
+
     def _set_maximum_output_width(self, parser, word, section):
         try:
             self.maximum_output_width[section] = uint(word)
@@ -173,15 +193,26 @@ class Config(object):
     def money(self, amount):
         return self.currency.money(amount)
 
+    def money_formatter(self, symbol=False, thousands=True):
+        r"""Return a function that formats a Money object or number like
+        format_money(), and remembers the text of recently formatted amounts,
+        to format long columns of amounts.
+        """
+        return self.currency.formatter(symbol=symbol, thousands=thousands, memo=True)
+
     def format_money(self, amount, symbol=False, thousands=True):
-        global abo
-        import abo.money
-        if not isinstance(amount, abo.money.Money):
-            amount = self.money(amount)
-        return amount.format(symbol=symbol, thousands=thousands)
+        return self.money_formatter(symbol=symbol, thousands=thousands)(amount)
+
+    def format_money_vector(self, vector, symbol=False, thousands=True, zero=None):
+        r"""Return a list of the formatted amounts of the given MoneyVector,
+        like format_money(), with any zero amounts replaced by the given text.
+        """
+        return vector.tagged(self.currency).format(symbol=symbol, thousands=thousands, zero=zero)
 
     def money_column_width(self):
-        return len(self.format_money(self.money(1000000)))
+        if self._money_column_width is None:
+            self._money_column_width = len(self.format_money(self.money(1000000)))
+        return self._money_column_width
 
     def balance_column_width(self):
         return self.money_column_width() + 1
@@ -123,33 +123,111 @@ import os
 import re
 import shlex
 import subprocess
+import tempfile
+import itertools
+import contextlib
 import datetime
-import copy
+import hashlib
+import functools
 from abo.transaction import Transaction
 import abo.account
 import abo.text
 from abo.types import struct
 
+# Journal files at least this large are parsed in chunks by worker processes,
+# if more than one worker is allowed.
+PARALLEL_PARSE_SIZE = 1 << 20
+
 class ParseException(abo.text.LineError):
 
     def __init__(self, source, message):
         super().__init__(str(message), line=source)
 
     def __reduce__(self):
-        return (self.__class__, (self.line, self.message))
+        return (self.__class__, (self.line, self.msg))
+
+class KeyLine(abo.text.Line):
+
+    r"""A journal Line parsed into a key and the text that follows it.
+    """
+
+    __slots__ = ('key', 'text')
 
 class Journal(object):
 
-    def __init__(self, config, source_file, chart=None):
+    def __init__(self, config, source_file, chart=None, memo=None, filter_cache=None, workers=1):
         self.config = config
         self.chart = chart
         self.source_file = source_file
+        self.memo = memo
+        self.filter_cache = filter_cache
+        self.workers = workers
+        self.block_keys = []
 
     def transactions(self):
         return self._parse(self.source_file)
 
     _regex_filter = re.compile(r'^%filter\s+(.*)$', re.MULTILINE)
 
+    def _filter(self, args, lines, source_path):
+        r"""Iterate over the lines output by the given filter command, which
+        reads the source file itself if it has a path, otherwise is given the
+        lines on its standard input.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        if source_path is not None:
+            stdin = open(os.devnull, 'rb')
+            with open(source_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(chunk)
+        else:
+            stdin = tempfile.TemporaryFile()
+            for line in lines:
+                data = line.encode()
+                digest.update(data)
+                stdin.write(data)
+            stdin.seek(0)
+        with stdin:
+            # The filter's output depends only on its arguments and input, so
+            # a cached output can be re-used whatever else has changed.
+            key = (tuple(args), digest.digest())
+            cached = self.filter_cache.open(key) if self.filter_cache is not None else None
+            if cached is not None:
+                logging.debug("re-use output of %r" % (args,))
+                with cached:
+                    for line in cached:
+                        yield line.decode()
+                return
+            with subprocess.Popen(args, cwd=self.config.base_dir_path, stdin=stdin, stdout=subprocess.PIPE) as proc, \
+                 (self.filter_cache.create(key) if self.filter_cache is not None else contextlib.nullcontext()) as save:
+                for line in proc.stdout:
+                    if save is not None:
+                        save.write(line)
+                    yield line.decode()
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, args)
+
+    # The keys of a legacy block, which may also be given by %default.
+    _template = {
+        'type': None,
+        'date': None,
+        'due': None,
+        'who': None,
+        'what': None,
+        'tag': [],
+        'db': [],
+        'cr': [],
+        'acc': None,
+        'item': [],
+        'bank': None,
+        'gst': None,
+        'amt': None,
+    }
+
+    @classmethod
+    def _empty_keys(cls):
+        return dict((key, [] if type(value) is list else None) for key, value in cls._template.items())
+
     def _parse(self, source_file):
         if isinstance(source_file, str):
             # To facilitate testing.
@@ -161,8 +239,11 @@ class Journal(object):
             source_path = source_file.name if os.path.exists(source_file.name) else None
         name = getattr(source_file, 'name', str(source_file))
         logging.info("parse %r", name)
-        lines = list(source_file)
-        m = self._regex_filter.search(''.join(lines[:10]))
+        # Detect a %filter directive in the first few lines, without reading
+        # the rest of the file.
+        head = list(itertools.islice(source_file, 10))
+        lines = itertools.chain(head, source_file)
+        m = self._regex_filter.search(''.join(head))
         if m:
             args = shlex.split(m.group(1))
             if source_path is not None:
@@ -173,126 +254,125 @@ class Journal(object):
                         expanded = True
                 if not expanded:
                     args.append(source_path)
-                out = subprocess.check_output(args, cwd=self.config.base_dir_path, stdin=open('/dev/null'))
-            else:
-                out, err = subprocess.Popen(args,
-                                            cwd=self.config.base_dir_path,
-                                            stdin=subprocess.PIPE,
-                                            stdout=subprocess.PIPE)\
-                                     .communicate(''.join(lines).encode())
-            import io
-            lines = list(io.StringIO(out.decode()))
-        lines = [line.rstrip('\n') for line in lines]
+            lines = self._filter(args, lines, source_path)
+        elif (      self.workers > 1
+                and not self.memo
+                and source_path is not None
+                and os.path.getsize(source_path) >= PARALLEL_PARSE_SIZE):
+            yield from self._parse_parallel(lines, source_file.name)
+            return
+        lines = (line.rstrip('\n') for line in lines)
         lines = abo.text.number_lines(lines, name=source_file.name)
-        blocks = abo.text.line_blocks(lines)
-        template = {
-            'type': None,
-            'date': None,
-            'due': None,
-            'who': None,
-            'what': None,
-            'tag': [],
-            'db': [],
-            'cr': [],
-            'acc': None,
-            'item': [],
-            'bank': None,
-            'gst': None,
-            'amt': None,
-        }
-        defaults = copy.deepcopy(template)
+        self._period = None
+        yield from self._parse_blocks(abo.text.line_blocks(lines), self._empty_keys(), False)
+
+    def _parse_parallel(self, lines, name):
+        # Split the file into chunks at blank lines, which always separate
+        # blocks, and parse the chunks in worker processes.  Every chunk starts
+        # in the state (defaults, projection and period) left by the
+        # directives that precede it, so scan all directives first, ignoring
+        # any errors, which the worker that parses the offending line raises
+        # in its turn.
+        lines = list(abo.text.number_lines((line.rstrip('\n') for line in lines), name=name))
+        chunk_size = max(1, len(lines) // (self.workers * 4))
+        chunks = []
+        defaults = self._empty_keys()
         in_projection = False
         self._period = None
+        start = 0
+        state = (dict(defaults), in_projection, self._period)
+        for i, line in enumerate(lines):
+            if i - start >= chunk_size and not line.string:
+                chunks.append((lines[start:i],) + state)
+                start = i
+                state = (dict(defaults), in_projection, self._period)
+            words = line.string.split(None, 1)
+            if words and words[0].startswith('%'):
+                try:
+                    defaults, in_projection = self._parse_directive(line, words, defaults, in_projection)
+                except (ParseException, ValueError, IndexError):
+                    pass
+        chunks.append((lines[start:],) + state)
+        logging.debug("parse %r in %u chunks" % (name, len(chunks)))
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.workers, len(chunks)),
+                                                    initializer=_init_chunk_worker,
+                                                    initargs=(self.config, self.chart, self.memo is not None)) as executor:
+            for transactions, block_keys in executor.map(_parse_chunk, chunks):
+                self.block_keys += block_keys
+                yield from transactions
+
+    def _parse_blocks(self, blocks, defaults, in_projection):
+        memo_state = None
         for block in blocks:
+            # If given a memo of previously parsed blocks, then a block without
+            # directives whose text and inherited state (defaults, period and
+            # projection) are unchanged yields the same transaction as before.
+            key = None
+            if self.memo is not None and not any(line.string.lstrip().startswith('%') for line in block):
+                if memo_state is None:
+                    memo_state = repr((sorted(defaults.items()), in_projection, self._period))
+                key = self.block_key(memo_state, block)
+                t = self.memo.get(key)
+                if t is not None:
+                    self.block_keys.append(key)
+                    yield t
+                    continue
+            else:
+                memo_state = None
             firstline = None
             ledger_date = None
-            ledger_what = None
+            ledger_line = None
             ledger_lines = []
-            keys = copy.deepcopy(template)
+            keys = None
             percent_block = None
             for line in block:
-                words = line.split(None, 1)
+                text = line.string
+                words = text.split(None, 1)
                 if not words:
                     continue
                 if words[0].startswith('%'):
                     if percent_block is False:
                         raise ParseException(line, 'at ' + words[0] + ': not permitted within transaction')
                     percent_block = True
-                if words[0] == '%default':
-                    try:
-                        self._parse_line_keytext(line, words[1])
-                    except ParseException:
-                        raise ParseException(line, 'in %default: ' + e)
-                    if line.key not in defaults:
-                        raise ParseException(line, 'invalid %%default key %r' % line.key)
-                    if not line.text:
-                        defaults[line.key] = None
-                    elif type(template[line.key]) is list:
-                        defaults[line.key] = [line]
-                    else:
-                        defaults[line.key] = line
-                elif words[0] == '%period':
-                    self._period = None
-                    if len(words) > 1:
-                        try:
-                            start, end = list(map(self._parse_date, words[1].split(None, 1)))
-                        except (IndexError, ValueError):
-                            raise ParseException(line, 'invalid %period arguments')
-                        if (    end <= start
-                            or  end >= start + datetime.timedelta(days=366)
-                            or  (end.year != start.year and end.replace(year=start.year) >= start)):
-                            raise ParseException(line, 'invalid %period date range')
-                        self._period = (start, end)
-                elif words[0] == '%projection':
-                    if len(words) > 1:
-                        raise ParseException(line, 'spurious %projection arguments')
-                    if in_projection:
-                        raise ParseException(line, 'unexpected %projection (missing %end projection)')
-                    in_projection = True
-                elif words[0] == '%end':
-                    if len(words) < 2:
-                        raise ParseException(line, 'missing %end argument')
-                    if words[1] == 'projection':
-                        if not in_projection:
-                            raise ParseException(line, 'unexpected %end projection (missing %projection?)')
-                        in_projection = False
-                    elif words[1] == 'defaults':
-                        defaults = copy.deepcopy(template)
-                    else:
-                        raise ParseException(line, 'unsupported %end argument')
-                if words[0].startswith('%'):
+                    defaults, in_projection = self._parse_directive(line, words, defaults, in_projection)
                     continue
                 percent_block = False
                 if ledger_date:
-                    if line[0].isspace():
-                        ledger_lines.append(line.lstrip())
+                    if text[0].isspace():
+                        line.string = text.lstrip()
+                        ledger_lines.append(line)
                     else:
                         raise ParseException(line, 'should be indented')
+                elif keys is None and words[0] not in self._template:
+                    # A ledger block starts with its date, and has no keys.
+                    try:
+                        ledger_date = self._parse_date_edate(words[0])
+                    except ValueError:
+                        raise ParseException(line, 'invalid date %r' % words[0])
+                    ledger_line = self._words_key_line(line, words)
                 else:
-                    self._parse_line_keytext(line, line)
-                    if line.key in keys:
-                        if not firstline:
-                            firstline = line
-                        if type(keys[line.key]) is list:
-                            keys[line.key].append(line)
-                        elif keys[line.key] is None:
-                            keys[line.key] = line
+                    kline = self._words_key_line(line, words)
+                    if keys is None:
+                        # Only lists of keys that are present are created.
+                        keys = dict.fromkeys(self._template)
+                        firstline = kline
+                    if kline.key not in keys:
+                        raise ParseException(line, 'invalid key %r' % kline.key)
+                    if type(self._template[kline.key]) is list:
+                        if keys[kline.key] is None:
+                            keys[kline.key] = [kline]
                         else:
-                            raise ParseException(line, 'duplicate key %r' % line.key)
-                        continue
-                    elif not firstline:
-                        try:
-                            ledger_date = self._parse_date_edate(line.key)
-                            ledger_what = line.text
-                        except ValueError:
-                            raise ParseException(line, 'invalid date %r' % line.key)
+                            keys[kline.key].append(kline)
+                    elif keys[kline.key] is None:
+                        keys[kline.key] = kline
                     else:
-                        raise ParseException(line, 'invalid key %r' % line.key)
+                        raise ParseException(line, 'duplicate key %r' % kline.key)
             kwargs = None
             if firstline:
                 kwargs = self._parse_legacy_block(firstline, keys, defaults)
             elif ledger_date:
-                kwargs = self._parse_ledger_block(ledger_date, ledger_what, ledger_lines)
+                kwargs = self._parse_ledger_block(ledger_line, ledger_date, ledger_lines)
             if kwargs:
                 line = firstline or ledger_lines[0]
                 if len(kwargs['entries']) < 2:
@@ -301,35 +381,94 @@ class Journal(object):
                     del entry['line']
                 kwargs['is_projection'] = in_projection
                 try:
-                    yield Transaction(config=self.config, **kwargs)
+                    t = Transaction(config=self.config, **kwargs)
                 except:
                     abo.text.raise_with_context(line)
                     raise
+                self.block_keys.append(key)
+                yield t
+
+    def _parse_directive(self, line, words, defaults, in_projection):
+        r"""Apply a single %directive line to the given defaults and projection
+        state and to the current period, and return the new defaults and
+        projection state.
+        """
+        if words[0] == '%default':
+            try:
+                kline = self._key_line(line, words[1])
+            except ParseException as e:
+                raise ParseException(line, 'in %default: ' + e.msg)
+            if kline.key not in defaults:
+                raise ParseException(line, 'invalid %%default key %r' % kline.key)
+            if not kline.text:
+                defaults[kline.key] = None
+            elif type(self._template[kline.key]) is list:
+                defaults[kline.key] = [kline]
+            else:
+                defaults[kline.key] = kline
+        elif words[0] == '%period':
+            self._period = None
+            if len(words) > 1:
+                try:
+                    start, end = list(map(self._parse_date, words[1].split(None, 1)))
+                except (IndexError, ValueError):
+                    raise ParseException(line, 'invalid %period arguments')
+                if (    end <= start
+                    or  end >= start + datetime.timedelta(days=366)
+                    or  (end.year != start.year and end.replace(year=start.year) >= start)):
+                    raise ParseException(line, 'invalid %period date range')
+                self._period = (start, end)
+        elif words[0] == '%projection':
+            if len(words) > 1:
+                raise ParseException(line, 'spurious %projection arguments')
+            if in_projection:
+                raise ParseException(line, 'unexpected %projection (missing %end projection)')
+            in_projection = True
+        elif words[0] == '%end':
+            if len(words) < 2:
+                raise ParseException(line, 'missing %end argument')
+            if words[1] == 'projection':
+                if not in_projection:
+                    raise ParseException(line, 'unexpected %end projection (missing %projection?)')
+                in_projection = False
+            elif words[1] == 'defaults':
+                defaults = self._empty_keys()
+            else:
+                raise ParseException(line, 'unsupported %end argument')
+        return defaults, in_projection
+
+    @staticmethod
+    def block_key(state, block):
+        h = hashlib.blake2b(state.encode('utf8'), digest_size=16)
+        for line in block:
+            h.update(b'\n' + line.string.encode('utf8'))
+        return h.digest()
 
     _regex_ledger_due = re.compile(r'\s*{([^}]*)}\s*')
 
-    def _parse_ledger_block(self, ledger_date, ledger_what, ledger_lines):
-        what, tags = abo.account.Chart.parse_tags(ledger_what)
+    def _parse_ledger_block(self, ledger_line, ledger_date, ledger_lines):
+        what, tags = abo.account.Chart.parse_tags(ledger_line.text)
         if ';' in what:
-            who, what = map(str.strip, str(what).split(';', 1))
+            who, what = map(str.strip, what.split(';', 1))
         else:
             who = None
-            what = str(what).strip()
+            what = what.strip()
         entries = []
         noamt = None
         for line in ledger_lines:
             entry = {'line': line}
-            if ';' in line:
-                line, detail = line.split(';', 1)
+            text = line.string
+            if ';' in text:
+                text, detail = text.split(';', 1)
                 m = self._regex_ledger_due.search(detail)
                 if m:
                     entry['cdate'] = self._parse_date(m.group(1), relative_to=ledger_date[0])
                     detail = (detail[:m.start(0)] + ' ' + detail[m.end(0):])
-                entry['detail'] = str(detail).strip()
-            line = line.rstrip()
-            if '  ' in line:
-                acc, amt = line.rsplit('  ', 1)
-                acc = str(acc.strip())
+                entry['detail'] = detail.strip()
+            text = text.rstrip()
+            if '  ' in text:
+                acc, amt = text.rsplit('  ', 1)
+                acc = acc.strip()
                 amt = amt.strip()
                 try:
                     amount = self.config.parse_money(amt)
@@ -339,7 +478,7 @@ class Journal(object):
                     raise ParseException(line, 'zero amount')
                 entry['amount'] = amount
             else:
-                acc = str(line.strip())
+                acc = text.strip()
                 if noamt:
                     raise ParseException(line, 'missing amount')
                 noamt = entry
@@ -362,7 +501,7 @@ class Journal(object):
             total_db = sum(-entry['amount'] for entry in entries if entry['amount'] < 0)
             total_cr = sum(entry['amount'] for entry in entries if entry['amount'] > 0)
             if total_db != total_cr:
-                raise ParseException(ledger_what, 'debits (%s) sum %s credits (%s) by %s' % (
+                raise ParseException(ledger_line, 'debits (%s) sum %s credits (%s) by %s' % (
                                                       total_db,
                                                       'above' if total_db > total_cr else 'below',
                                                       total_cr,
@@ -390,7 +529,8 @@ class Journal(object):
         if not meth:
             raise ParseException(keys['type'], 'unknown type %r' % (keys['type'].text,))
         kwargs = {}
-        kwargs['date'], kwargs['edate'] = self._parse_date_edate(keyline('date').text)
+        date = keyline('date')
+        kwargs['date'], kwargs['edate'] = self._parse_date_edate(date.text, line=date)
         who = keyline('who', optional=True)
         kwargs['who'] = str(who.text) if who else None
         what = keyline('what', optional=True)
@@ -406,14 +546,18 @@ class Journal(object):
                 raise ParseException(line, 'spurious %r key' % (key,))
         return kwargs
 
-    def _parse_line_keytext(cls, line, text):
-        words = text.split(None, 1)
-        if len(words) == 2:
-            line.key, line.text = str(words[0]), words[1]
-        elif len(words) == 1:
-            line.key, line.text = str(words[0]), ''
-        else:
+    @classmethod
+    def _key_line(cls, line, text):
+        return cls._words_key_line(line, text.split(None, 1))
+
+    @staticmethod
+    def _words_key_line(line, words):
+        if not words:
             raise ParseException(line, 'expecting <key> [value]')
+        kline = KeyLine(line.string, line.name, line.line_number)
+        kline.key = words[0]
+        kline.text = words[1] if len(words) == 2 else ''
+        return kline
 
     def _parse_type_transaction(self, firstline, kwargs, keyline):
         amt = keyline('amt', optional=True)
@@ -455,12 +599,12 @@ class Journal(object):
 
     def _parse_invoice_bill(self, firstline, kwargs, keyline, sign):
         due = keyline('due', optional=True)
-        cdate = self._parse_date(due.text, relative_to=kwargs['date']) if due else None
+        cdate = self._parse_date(due.text, relative_to=kwargs['date'], line=due) if due else None
         amt = keyline('amt', optional=True)
         amount = self._parse_money(amt) if amt else None
         entries = []
         acc = keyline('acc', optional=True)
-        account = self._parse_account_label(acc.text.rstrip())
+        account = self._parse_account_label(acc, acc.text.rstrip())
         total = 0
         gst = keyline('gst', optional=True)
         gst_amount = self._parse_money(gst) if gst else None
@@ -506,9 +650,9 @@ class Journal(object):
     def _parse_remittance_receipt(self, firstline, kwargs, keyline, sign):
         amount = self._parse_money(keyline('amt'))
         acc = keyline('acc')
-        account = self._parse_account_label(acc.text.rstrip())
+        account = self._parse_account_label(acc, acc.text.rstrip())
         bank = keyline('bank')
-        bank_account = self._parse_account_label(bank.text.rstrip())
+        bank_account = self._parse_account_label(bank, bank.text.rstrip())
         entries = []
         entries.append({'line': acc, 'account': account, 'amount': amount * sign})
         entries.append({'line': bank, 'account': bank_account, 'amount': amount * -sign})
@@ -522,50 +666,18 @@ class Journal(object):
 
     _regex_relative = re.compile(r'^[+-]\d+$')
 
-    def _parse_date(self, text, relative_to=None):
-        d = None
-        enforce = True
-        if text.endswith("!"):
-            enforce = False
-            text = text[:-1]
-        if relative_to is not None:
-            dmy = text.split('/', 2)
-            if len(dmy) == 3:
-                if not dmy[0]:
-                    dmy[0] = '%u' % relative_to.day
-                if not dmy[1]:
-                    dmy[1] = '%u' % relative_to.month
-                if not dmy[2]:
-                    dmy[2] = '%04u' % relative_to.year
-                text = '/'.join(dmy)
+    def _parse_date(self, text, relative_to=None, line=None):
         try:
-            d = datetime.datetime.strptime(text, '%d/%m/%Y').date()
-        except ValueError:
-            if self._period:
-                enforce = True
-                try:
-                    d = datetime.datetime.strptime(text + '/%04u' % self._period[0].year, '%d/%m/%Y').date()
-                    if d < self._period[0]:
-                        d = None
-                except ValueError:
-                    pass
-                if d is None and self._period[0].year != self._period[1].year:
-                    try:
-                        d = datetime.datetime.strptime(text + '/%04u' % self._period[1].year, '%d/%m/%Y').date()
-                    except ValueError:
-                        pass
-        if d is not None:
-            if enforce and self._period and (d < self._period[0] or d > self._period[1]):
-                raise ParseException(text, 'date %s outside period' % text)
-            return d
-        if relative_to is not None and self._regex_relative.match(text):
-            return relative_to + datetime.timedelta(int(text))
-        raise ParseException(text, 'invalid date %r' % text)
-
-    def _parse_date_edate(self, text):
+            return _parse_dmy(text, relative_to, self._period)
+        except ParseException as e:
+            if line is None:
+                raise
+            raise ParseException(line, e.msg) from None
+
+    def _parse_date_edate(self, text, line=None):
         texts = text.split('=', 1)
-        date = self._parse_date(texts[0])
-        edate = self._parse_date(texts[1], relative_to=date) if len(texts) > 1 else None
+        date = self._parse_date(texts[0], line=line)
+        edate = self._parse_date(texts[1], relative_to=date, line=line) if len(texts) > 1 else None
         return date, edate
 
     def _gst_account_bill(self, line):
@@ -600,17 +712,17 @@ class Journal(object):
         except ValueError as e:
             raise ParseException(line, e)
 
-    def _parse_account_label(self, text):
+    def _parse_account_label(self, line, text):
         if self.chart:
             try:
-                account = self.chart[str(text)]
+                account = self.chart[text]
             except (ValueError, KeyError) as e:
-                raise ParseException(text, e)
+                raise ParseException(line, e)
             if not account.is_substantial():
-                raise ParseException(text, 'insubstantial account %r' % account.label)
+                raise ParseException(line, 'insubstantial account %r' % account.label)
             return account
         else:
-            return str(text)
+            return text
 
     def _parse_money(self, line):
         try:
@@ -622,7 +734,7 @@ class Journal(object):
         entry = {'line': line}
         word, text = self._popword(line.text)
         assert word, "line.text=%r word=%r" % (line.text, word,)
-        entry['account'] = self._parse_account_label(word)
+        entry['account'] = self._parse_account_label(line, word)
         money = None
         word, detail = self._popword(text)
         if word and self.appears_money(word):
@@ -654,6 +766,178 @@ class Journal(object):
     def appears_money(cls, text):
         return cls._regex_amount.search(text) is not None
 
+def ledger_lines(transactions):
+    r"""Return an iterator over the lines of a journal in ledger format that
+    parses into the given Transactions, eg, to regenerate the text of a frozen
+    journal (see abo.cache.thaw()).
+
+    >>> text = r'''
+    ... 1/2/2013=28/2/2013 Somebody; something =one =two
+    ...   account1  -21.90 ; a debit {+30}
+    ...   account2  21.90
+    ...
+    ... %projection
+    ...
+    ... 3/2/2013 another
+    ...   account1  -1.00
+    ...   account2  1.00 ; credit
+    ...
+    ... %end projection
+    ... '''
+    >>> t1 = list(Journal(_testconfig, text).transactions())
+    >>> for line in ledger_lines(t1): print(line)
+    <BLANKLINE>
+    1/2/2013=28/2/2013 Somebody; something =one =two
+      account1  -21.90 ; a debit {3/3/2013}
+      account2  21.90
+    <BLANKLINE>
+    %projection
+    <BLANKLINE>
+    3/2/2013 another
+      account1  -1.00
+      account2  1.00 ; credit
+    <BLANKLINE>
+    %end projection
+    >>> t2 = list(Journal(_testconfig, '\n'.join(ledger_lines(t1))).transactions())
+    >>> list(map(repr, t2)) == list(map(repr, t1)), [t.is_projection for t in t2]
+    (True, [False, True])
+    """
+    def dmy(date):
+        return '%u/%u/%04u' % (date.day, date.month, date.year)
+    in_projection = False
+    for t in transactions:
+        if t.is_projection != in_projection:
+            yield ''
+            yield '%projection' if t.is_projection else '%end projection'
+            in_projection = t.is_projection
+        yield ''
+        line = dmy(t.date)
+        if t.edate != t.date:
+            line += '=' + dmy(t.edate)
+        if t.who:
+            line += ' ' + t.who + ';'
+        if t.what:
+            line += ' ' + t.what
+        for tag in sorted(t.tags):
+            line += ' =' + tag
+        yield line
+        for e in t.entries:
+            line = '  %s  %s' % (e.account, e.amount.amount)
+            if e.detail or e.cdate:
+                line += ' ;'
+                if e.detail:
+                    line += ' ' + e.detail
+                if e.cdate:
+                    line += ' {' + dmy(e.cdate) + '}'
+            yield line
+    if in_projection:
+        yield ''
+        yield '%end projection'
+
+# The same pattern as strptime() uses for '%d/%m/%Y', with an optional year.
+_regex_dmy = re.compile(r'(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])/(1[0-2]|0[1-9]|[1-9])(?:/(\d\d\d\d))?\Z')
+
+# The number of distinct dates remembered by _parse_dmy().
+DATE_MEMO_SIZE = 4096
+
+@functools.lru_cache(maxsize=DATE_MEMO_SIZE)
+def _parse_dmy(text, relative_to, period):
+    r"""Return the date given by a journal date field in the form d/m/Y, in
+    which a '!' suffix exempts the date from the period, missing fields default
+    to those of the relative_to date, if given, and the year may be omitted if
+    a period (start, end) is given.
+
+    >>> _parse_dmy('9/3/2013', None, None), _parse_dmy('09/03/2013', None, None)
+    (datetime.date(2013, 3, 9), datetime.date(2013, 3, 9))
+    >>> _parse_dmy('/4/', datetime.date(2013, 3, 9), None), _parse_dmy('+30', datetime.date(2013, 3, 9), None)
+    (datetime.date(2013, 4, 9), datetime.date(2013, 4, 8))
+    >>> fy = (datetime.date(2012, 7, 1), datetime.date(2013, 6, 30))
+    >>> _parse_dmy('28/2', None, fy), _parse_dmy('1/8', None, fy), _parse_dmy('1/8/2013!', None, fy)
+    (datetime.date(2013, 2, 28), datetime.date(2012, 8, 1), datetime.date(2013, 8, 1))
+
+    An invalid day or month is an error, every time:
+
+    >>> _parse_dmy('31/4/2013', None, None)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '31/4/2013'
+    >>> _parse_dmy('31/4/2013', None, None)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '31/4/2013'
+    >>> _parse_dmy('1/13/2013', None, None)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '1/13/2013'
+    >>> _parse_dmy('0/1/2013', None, None)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '0/1/2013'
+    >>> _parse_dmy('29/2', None, fy)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '29/2'
+    >>> _parse_dmy('1/3/13', None, None)
+    Traceback (most recent call last):
+    abo.journal.ParseException: invalid date '1/3/13'
+    >>> _parse_dmy('1/8/2013', None, fy)
+    Traceback (most recent call last):
+    abo.journal.ParseException: date 1/8/2013 outside period
+    """
+    enforce = True
+    if text.endswith("!"):
+        enforce = False
+        text = text[:-1]
+    if relative_to is not None:
+        dmy = text.split('/', 2)
+        if len(dmy) == 3:
+            if not dmy[0]:
+                dmy[0] = '%u' % relative_to.day
+            if not dmy[1]:
+                dmy[1] = '%u' % relative_to.month
+            if not dmy[2]:
+                dmy[2] = '%04u' % relative_to.year
+            text = '/'.join(dmy)
+    d = None
+    m = _regex_dmy.match(text)
+    if m:
+        day, month, year = m.groups()
+        if year is not None:
+            try:
+                d = datetime.date(int(year), int(month), int(day))
+            except ValueError:
+                pass
+        elif period:
+            enforce = True
+            try:
+                d = datetime.date(period[0].year, int(month), int(day))
+                if d < period[0]:
+                    d = None
+            except ValueError:
+                pass
+            if d is None and period[0].year != period[1].year:
+                try:
+                    d = datetime.date(period[1].year, int(month), int(day))
+                except ValueError:
+                    pass
+    if d is not None:
+        if enforce and period and (d < period[0] or d > period[1]):
+            raise ParseException(text, 'date %s outside period' % text)
+        return d
+    if relative_to is not None and Journal._regex_relative.match(text):
+        return relative_to + datetime.timedelta(int(text))
+    raise ParseException(text, 'invalid date %r' % text)
+
+# The Journal in each worker process that parses chunks of a large file.
+_chunk_journal = None
+
+def _init_chunk_worker(config, chart, keyed):
+    global _chunk_journal
+    _chunk_journal = Journal(config, None, chart=chart, memo={} if keyed else None)
+
+def _parse_chunk(chunk):
+    lines, defaults, in_projection, period = chunk
+    journal = _chunk_journal
+    journal.block_keys = []
+    journal._period = period
+    transactions = list(journal._parse_blocks(abo.text.line_blocks(lines), defaults, in_projection))
+    return transactions, journal.block_keys
+
 __test__ = {
 'transaction':r"""
 
@@ -870,6 +1154,26 @@ abo.journal.ParseException: StringIO, 8: spurious 'item' key
     entries=(Entry(account='cash', amount=Money.AUD(-55.65)),
              Entry(account='body', amount=Money.AUD(55.65))))]
 
+A filter is not run again if its output for the same input is cached:
+
+>>> import tempfile, abo.cache
+>>> filter_cache = abo.cache.FilterCache(struct(cache_dir_path=tempfile.mkdtemp()))
+>>> text = r'''
+... %filter sed s/here/there/
+... 1/3/2013 here
+...  food  10.00
+...  bank
+... '''
+>>> [t.what for t in Journal(_testconfig, text, filter_cache=filter_cache).transactions()]
+['there']
+>>> key = (('sed', 's/here/there/'), hashlib.blake2b(text.encode(), digest_size=20).digest())
+>>> with filter_cache.create(key) as f:
+...     _ = f.write(b'1/3/2013 elsewhere\n food  10.00\n bank\n')
+>>> [t.what for t in Journal(_testconfig, text, filter_cache=filter_cache).transactions()]
+['elsewhere']
+>>> [t.what for t in Journal(_testconfig, text.replace('10', '11'), filter_cache=filter_cache).transactions()]
+['there']
+
 """,
 'period':r"""
 
@@ -901,5 +1205,164 @@ abo.journal.ParseException: StringIO, 8: spurious 'item' key
 Traceback (most recent call last):
 abo.journal.ParseException: StringIO, 4: invalid date '29/2'
 
+""",
+'keys':r"""
+
+A ledger block, which has no keys, parses into the same transaction as the
+equivalent block of keys:
+
+>>> ledger = list(Journal(_testconfig, r'''
+... 21/2/2013 Somebody; something =wah
+...  food  -10.00
+...  bank
+... ''').transactions())
+>>> keyed = list(Journal(_testconfig, r'''
+... type transaction
+... date 21/2/2013
+... who Somebody
+... what something
+... tag wah
+... db food
+... cr bank
+... amt 10.00
+... ''').transactions())
+>>> list(map(repr, ledger)) == list(map(repr, keyed))
+True
+
+Malformed blocks are reported at the offending line:
+
+>>> list(Journal(_testconfig, r'''
+... type transaction
+... date 21/2/2013
+... whom Somebody
+... ''').transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 4: invalid key 'whom'
+>>> list(Journal(_testconfig, r'''
+... type transaction
+... date 21/2/2013
+... date 22/2/2013
+... ''').transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 4: duplicate key 'date'
+>>> list(Journal(_testconfig, r'''
+... 1/2/2013 something
+...  food  1.00
+...  bank
+...
+... type transaction
+... 21/2/2013 Somebody
+... ''').transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 7: invalid key '21/2/2013'
+>>> list(Journal(_testconfig, r'''
+... 31/2/2013 something
+...  food  1.00
+...  bank
+... ''').transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 2: invalid date '31/2/2013'
+>>> list(Journal(_testconfig, r'''
+... 1/2/2013 something
+...  food  1.00
+... bank
+... ''').transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 4: should be indented
+
+""",
+'date':r"""
+
+An invalid date is reported with the line it is on, even if the same date has
+already been reported on another line:
+
+>>> text = r'''
+... 1/3/2013 something
+...  food  10.00
+...  bank
+...
+... 31/4/2013 another thing
+...  food  20.00
+...  bank
+... '''
+>>> list(Journal(_testconfig, text).transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 6: invalid date '31/4/2013'
+>>> list(Journal(_testconfig, text.replace('1/3/2013', '31/4/2013')).transactions())
+Traceback (most recent call last):
+abo.journal.ParseException: StringIO, 2: invalid date '31/4/2013'
+
+""",
+'memo':r"""
+
+A memo of previously parsed blocks is re-used for every block whose text and
+inherited defaults are unchanged, and no others:
+
+>>> text = r'''
+... %default who Somebody
+...
+... 1/3/2013 something
+...  food  10.00
+...  bank
+...
+... 2/3/2013 another thing
+...  food  20.00
+...  bank
+... '''
+>>> j1 = Journal(_testconfig, text, memo={})
+>>> t1 = list(j1.transactions())
+>>> len(j1.block_keys)
+2
+>>> memo = dict(zip(j1.block_keys, t1))
+>>> j2 = Journal(_testconfig, text.replace('20.00', '25.00'), memo=memo)
+>>> t2 = list(j2.transactions())
+>>> t2[0] is t1[0], t2[1] is t1[1]
+(True, False)
+>>> t2[1].amount()
+Money.AUD(25.00)
+>>> j3 = Journal(_testconfig, text.replace('Somebody', 'Anybody'), memo=memo)
+>>> [t is u for t, u in zip(j3.transactions(), t1)]
+[False, False]
+
+""",
+'parallel':r"""
+>>> import tempfile, os.path
+>>> text = ''.join(r'''
+... %%default type transaction
+... %%default who Somebody
+... %%period 1/1/2013 31/12/2013
+...
+... date %u/1
+... what Something
+... db account1
+... cr account2
+... amt 1.%02u
+...
+... %%end defaults
+... ''' % (i + 1, i) for i in range(20))
+>>> path = os.path.join(tempfile.mkdtemp(), 'journal')
+>>> with open(path, 'w') as f:
+...     _ = f.write(text + 'bad\n')
+>>> import abo.journal
+>>> abo.journal.PARALLEL_PARSE_SIZE = 0
+>>> j1 = Journal(_testconfig, open(path), memo={})
+>>> j2 = Journal(_testconfig, open(path), memo={}, workers=4)
+>>> list(j1.transactions()) #doctest: +ELLIPSIS
+Traceback (most recent call last):
+abo.journal.ParseException: /tmp/..., 241: invalid date 'bad'
+>>> list(j2.transactions()) #doctest: +ELLIPSIS
+Traceback (most recent call last):
+abo.journal.ParseException: /tmp/..., 241: invalid date 'bad'
+>>> with open(path, 'w') as f:
+...     _ = f.write(text)
+>>> j1 = Journal(_testconfig, open(path), memo={})
+>>> j2 = Journal(_testconfig, open(path), memo={}, workers=4)
+>>> t1, t2 = list(j1.transactions()), list(j2.transactions())
+>>> len(t2), t2[-1]
+(20, Transaction(date=datetime.date(2013, 1, 20), who='Somebody', what='Something', entries=(Entry(account='account1', amount=Money.AUD(-1.19)), Entry(account='account2', amount=Money.AUD(1.19)))))
+>>> list(map(repr, t1)) == list(map(repr, t2)), j1.block_keys == j2.block_keys
+(True, True)
+>>> abo.journal.PARALLEL_PARSE_SIZE = 1 << 20
+
 """,
 }
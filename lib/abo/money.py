@@ -16,10 +16,56 @@ if __name__ == "__main__":
 import logging
 # Suppress error caused by duplicate numeric code in iso_15294.xml
 logging.getLogger('pycountry.db').setLevel(logging.CRITICAL)
-import pycountry
 import re
+import array
+import itertools
 import decimal
 
+# The number of parsed amounts that each Currency remembers.  Money objects are
+# immutable, so the same one can be shared by every transaction that parses it.
+MONEY_MEMO_SIZE = 10000
+
+# The alpha-3 codes of all ISO 4217 currencies, so that checking a code does
+# not need to load the pycountry database, which takes longer than most reports.
+# Only codes missing from this table are looked up in pycountry, if installed.
+ISO_4217_CODES = frozenset("""
+        AED AFN ALL AMD AOA ARS AUD AWG AZN BAM BBD BDT BHD BIF BMD BND BOB BOV
+        BRL BSD BTN BWP BYN BZD CAD CDF CHE CHF CHW CLF CLP CNY COP COU CRC CUP
+        CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS GIP GMD GNF
+        GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR
+        KMF KPW KRW KWD KYD KZT LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT
+        MOP MRU MUR MVR MWK MXN MXV MYR MZN NAD NGN NIO NOK NPR NZD OMR PAB PEN
+        PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE
+        SOS SRD SSP STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX
+        USD USN UYI UYU UYW UZS VED VES VND VUV WST XAD XAF XAG XAU XBA XBB XBC
+        XBD XCD XCG XDR XOF XPD XPF XPT XSU XTS XUA XXX YER ZAR ZMW ZWG
+""".split())
+
+_other_codes = {}
+
+def is_currency_code(code):
+    r"""Return True if the given text is an ISO 4217 currency code.
+    >>> is_currency_code('AUD'), is_currency_code('aud'), is_currency_code('$10')
+    (True, False, False)
+    """
+    if code in ISO_4217_CODES:
+        return True
+    if not (len(code) == 3 and code.isascii() and code.isalpha() and code.isupper()):
+        return False
+    try:
+        return _other_codes[code]
+    except KeyError:
+        pass
+    try:
+        import pycountry
+    except ImportError:
+        valid = False
+    else:
+        currency = pycountry.currencies.get(alpha_3=code)
+        valid = currency is not None and currency.alpha_3 == code
+    _other_codes[code] = valid
+    return valid
+
 class RegistryError(Exception):
     pass
 
@@ -37,11 +83,20 @@ class Currency(object):
         Currency.AUD
         >>> pickle.loads(pickle.dumps(Currency.AUD, 2)) is Currency.AUD
         True
+
+    A currency code is valid in any case:
+
+        >>> Currency('aud', 2).code
+        'aud'
+        >>> Currency('xyz', 2)
+        Traceback (most recent call last):
+        ValueError: invalid ISO 4217 currency code: 'xyz'
     """
 
     def __new__(cls, code, local_frac_digits=0, local_symbol=None, local_symbol_precedes=False, local_symbol_separated_by_space=False):
-        currency = pycountry.currencies.get(alpha_3=code)
-        if not currency:
+        # A code is valid in any case, as pycountry accepts, though only an
+        # upper case code is extracted from text (see extract_code()).
+        if not is_currency_code(str(code).upper()):
             raise ValueError('invalid ISO 4217 currency code: %r' % (code,))
         code = str(code)
         singleton = getattr(cls, code, None)
@@ -66,6 +121,9 @@ class Currency(object):
         self.float_context.rounding = decimal.ROUND_DOWN
         self.float_context.traps[decimal.Inexact] = False
         self.zero = decimal.Decimal(10, context=self.decimal_context) ** -self.local_frac_digits
+        self.scale = 10 ** self.local_frac_digits
+        self._money_memo = {}
+        self._formatters = {}
         return self
 
     def __getnewargs__(self):
@@ -153,16 +211,16 @@ class Currency(object):
         ('AUD', '5')
         >>> Currency.extract_code('xxx AUD')
         ('AUD', 'xxx')
+        >>> Currency.extract_code('100 aud')
+        (None, '100 aud')
         >>> Currency.extract_code('$100.71')
         (None, '$100.71')
         >>> Currency.extract_code('$AUD 100.71')
         (None, '$AUD 100.71')
         '''
-        currency = pycountry.currencies.get(alpha_3=text[:3])
-        if currency is not None and currency.alpha_3 == text[:3]:
+        if is_currency_code(text[:3]):
             return str(text[:3]), text[3:].lstrip()
-        currency = pycountry.currencies.get(alpha_3=text[-3:])
-        if currency is not None and currency.alpha_3 == text[-3:]:
+        if is_currency_code(text[-3:]):
             return str(text[-3:]), text[:-3].rstrip()
         return None, text
 
@@ -314,7 +372,23 @@ class Currency(object):
         except decimal.Inexact:
             raise ValueError('invalid literal for %r: %r' % (self, amount))
 
-    def format(self, amount, symbol=True, thousands=False, positive_sign='', positive_prefix='', positive_suffix='', negative_sign='-', negative_prefix='', negative_suffix=''):
+    def units(self, amount):
+        r'''Convert the given number into an integer number of minor units of
+        this currency, eg, cents.  Raise ValueError if the given amount would
+        have to be rounded.
+        >>> Currency.AUD.units(12)
+        1200
+        >>> Currency.AUD.units(decimal.Decimal('-0.05'))
+        -5
+        >>> Currency.AUD.units(1.011)
+        Traceback (most recent call last):
+        ValueError: invalid literal for Currency.AUD: 1.011
+        '''
+        if type(amount) is int:
+            return amount * self.scale
+        return int(self.quantize(amount).scaleb(self.local_frac_digits))
+
+    def format(self, amount, **kwargs):
         r'''Return a string representation of the Decimal amount with the
         currency symbol as prefix or suffix.
         >>> Currency.AUD.format(1)
@@ -330,22 +404,60 @@ class Currency(object):
         >>> Currency.EUR.format(1) == '1.00 €'
         True
         '''
-        amt = self.quantize(amount)
-        fmt = '{0:,}' if thousands else '{0}'
-        if symbol and self.local_symbol:
-            fmt = '{4}{1}{2}{3}'+fmt+'{5}' if self.local_symbol_precedes else '{4}{3}'+fmt+'{2}{1}{5}'
-        else:
-            fmt = '{4}{3}'+fmt+'{5}'
-        sep = ' ' if self.local_symbol_separated_by_space else ''
-        return (fmt.format(amt, self.local_symbol, sep, positive_sign, positive_prefix, positive_suffix) if amt >= 0
-                else fmt.format(-amt, self.local_symbol, sep, negative_sign, negative_prefix, negative_suffix))
+        return self.formatter(**kwargs).units(self.units(amount))
+
+    def format_units(self, units, **kwargs):
+        r'''Return a list of the string representations of the given amounts,
+        in minor units, formatted like format().
+        >>> Currency.AUD.format_units([100, -1234567, 0, 5], thousands=True)
+        ['$1.00', '$-12,345.67', '$0.00', '$0.05']
+        >>> Currency('VUV', 0, 'Vt', True, True).format_units([1200, -5])
+        ['Vt 1200', 'Vt -5']
+        '''
+        return self.formatter(**kwargs).column(units)
+
+    def formatter(self, **kwargs):
+        r'''Return a MoneyFormatter for this currency with the given options,
+        which is the same object every time it is asked for.
+        >>> Currency.AUD.formatter(thousands=True) is Currency.AUD.formatter(thousands=True)
+        True
+        '''
+        key = tuple(sorted(kwargs.items()))
+        formatter = self._formatters.get(key)
+        if formatter is None:
+            formatter = self._formatters[key] = MoneyFormatter(self, **kwargs)
+        return formatter
+
+    _plain_amount_regex = re.compile(r'[+-]?[0-9]+(?:\.[0-9]+)?\Z')
 
     def parse_amount_money(self, text):
-        r'''Parse given text into a Money object with this currency.
+        r'''Parse given text into a Money object with this currency.  A plain
+        decimal amount is parsed directly, bypassing currency codes and
+        symbols, and the most recently parsed amounts are remembered.
         >>> Currency.EUR.parse_amount_money('60001')
         Money.EUR(60001.00)
+        >>> Currency.AUD.parse_amount_money('-12.50')
+        Money.AUD(-12.50)
+        >>> Currency.AUD.parse_amount_money('-12.50') is Currency.AUD.parse_amount_money('-12.50')
+        True
+        >>> Currency.AUD.parse_amount_money('12.5')
+        Traceback (most recent call last):
+        ValueError: invalid literal for Currency.AUD: '12.5'
         '''
-        return Money.from_text(text, currency=self)
+        money = self._money_memo.get(text)
+        if money is None:
+            if self._plain_amount_regex.match(text):
+                whole, dot, frac = text.partition('.')
+                if not dot:
+                    money = self.money_factory.from_units(int(whole) * self.scale)
+                elif len(frac) == self.local_frac_digits:
+                    money = self.money_factory.from_units(int(whole + frac))
+            if money is None:
+                money = Money.from_text(text, currency=self)
+            if len(self._money_memo) >= MONEY_MEMO_SIZE:
+                self._money_memo.clear()
+            self._money_memo[text] = money
+        return money
 
     def money(self, amount):
         r'''Convert the given number into a Money object for this currency.
@@ -356,9 +468,22 @@ class Currency(object):
         '''
         return self.money_factory(amount)
 
+def _round_div(numerator, denominator):
+    # The integer nearest to numerator / denominator, rounding ties to even,
+    # like Decimal.quantize() in the default context.
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient & 1):
+        quotient += 1
+    return quotient
+
+def _unpickle_money(cls, units):
+    return cls.from_units(units)
+
 class Money(object):
 
-    r'''Represents an exact amount (not fractional) of a given single currency.
+    r'''Represents an exact amount (not fractional) of a given single currency,
+    as an integer number of minor units of the currency, eg, cents, so that
+    arithmetic is exact and fast.  The amount is available as a Decimal.
     >>> class AUD(Money):
     ...    currency = Currency.AUD
     >>> AUD(140)
@@ -382,11 +507,37 @@ class Money(object):
     AUD(175.00)
     >>> AUD(70) / 2
     AUD(35.00)
+    >>> AUD(0.35) * 0.5
+    AUD(0.18)
+    >>> AUD(10) / 3
+    Traceback (most recent call last):
+    ValueError: invalid literal for Currency.AUD: Decimal('3.333333333333333333333333333')
+    >>> AUD(140.01).units, AUD(140.01).amount
+    (14001, Decimal('140.01'))
     '''
 
+    __slots__ = ('units',)
+
     def __init__(self, amount):
         assert isinstance(self.currency, Currency)
-        self.amount = self.currency.quantize(amount)
+        self.units = self.currency.units(amount)
+
+    @classmethod
+    def from_units(cls, units):
+        r'''Return a Money object for the given integer number of minor units.
+        >>> Money.AUD.from_units(-2190)
+        Money.AUD(-21.90)
+        '''
+        self = object.__new__(cls)
+        self.units = units
+        return self
+
+    @property
+    def amount(self):
+        return decimal.Decimal(self.units).scaleb(-self.currency.local_frac_digits)
+
+    def __reduce__(self):
+        return (_unpickle_money, (type(self), self.units))
 
     @classmethod
     def register(cls, currency=None):
@@ -411,7 +562,7 @@ class Money(object):
                 assert singleton.currency is currency
                 assert currency.money_factory is singleton
                 return singleton
-            singleton = type(currency.code, (Money,), dict(currency=currency))
+            singleton = type(currency.code, (Money,), dict(currency=currency, __slots__=()))
         else:
             assert cls is not Money
             assert issubclass(cls, Money)
@@ -449,7 +600,7 @@ class Money(object):
         return currency.money(currency.parse_amount(number))
 
     def format(self, **kwargs):
-        return self.currency.format(self.amount, **kwargs)
+        return self.currency.formatter(**kwargs).units(self.units)
 
     def __str__(self):
         return '%s %s' % (self.amount, self.currency)
@@ -474,72 +625,330 @@ class Money(object):
         return '%s(%s)' % (classname, self.amount)
 
     def __bool__(self):
-        return bool(self.amount)
+        return bool(self.units)
 
     def __float__(self):
-        return float(self.amount)
+        return self.units / self.currency.scale
 
     def _unmoney(self, other, fmt):
+        # Return the given operand as minor units of this Money's currency.
+        if isinstance(other, Money):
+            if other.currency != self.currency:
+                raise CurrencyMismatch(fmt.format(self, other))
+            return other.units
+        return self.currency.units(other)
+
+    def _operands(self, other, fmt):
+        # Return a pair of values that compare like this Money and the given
+        # operand, which may be a number with more decimal places than this
+        # Money's currency.
         if isinstance(other, Money):
             if other.currency != self.currency:
                 raise CurrencyMismatch(fmt.format(self, other))
-            return other.amount
-        return other
+            return self.units, other.units
+        if type(other) is int:
+            return self.units, other * self.currency.scale
+        return self.amount, other
 
     def __hash__(self):
         return hash(self.currency) ^ hash(self.amount)
 
     def __eq__(self, other):
-        return self.amount == self._unmoney(other, '{0} == {1}')
+        a, b = self._operands(other, '{0} == {1}')
+        return a == b
 
     def __ne__(self, other):
-        return self.amount != self._unmoney(other, '{0} != {1}')
+        a, b = self._operands(other, '{0} != {1}')
+        return a != b
 
     def __lt__(self, other):
-        return self.amount < self._unmoney(other, '{0} < {1}')
+        a, b = self._operands(other, '{0} < {1}')
+        return a < b
 
     def __le__(self, other):
-        return self.amount <= self._unmoney(other, '{0} <= {1}')
+        a, b = self._operands(other, '{0} <= {1}')
+        return a <= b
 
     def __gt__(self, other):
-        return self.amount > self._unmoney(other, '{0} > {1}')
+        a, b = self._operands(other, '{0} > {1}')
+        return a > b
 
     def __ge__(self, other):
-        return self.amount >= self._unmoney(other, '{0} >= {1}')
+        a, b = self._operands(other, '{0} >= {1}')
+        return a >= b
 
     def __neg__(self):
-        return type(self)(-self.amount)
+        return self.from_units(-self.units)
 
     def __pos__(self):
-        return type(self)(+self.amount)
+        return self.from_units(self.units)
 
     def __abs__(self):
-        return type(self)(abs(self.amount))
+        return self.from_units(abs(self.units))
 
     def __add__(self, other):
-        return type(self)(self.amount + self._unmoney(other, '{0} + {1}'))
+        if type(other) is type(self):
+            return self.from_units(self.units + other.units)
+        return self.from_units(self.units + self._unmoney(other, '{0} + {1}'))
 
     def __sub__(self, other):
-        return type(self)(self.amount - self._unmoney(other, '{0} - {1}'))
+        if type(other) is type(self):
+            return self.from_units(self.units - other.units)
+        return self.from_units(self.units - self._unmoney(other, '{0} - {1}'))
 
     def __radd__(self, other):
-        return type(self)(self._unmoney(other, '{1} + {0}') + self.amount)
+        return self.from_units(self._unmoney(other, '{1} + {0}') + self.units)
 
     def __rsub__(self, other):
-        return type(self)(self._unmoney(other, '{1} - {0}') - self.amount)
+        return self.from_units(self._unmoney(other, '{1} - {0}') - self.units)
 
     def __mul__(self, other):
-        if isinstance(other, (float, int)):
-            return type(self)(decimal.Decimal(float(self.amount) * other).quantize(self.currency.zero))
+        if isinstance(other, int):
+            return self.from_units(self.units * other)
+        if isinstance(other, float):
+            numerator, denominator = other.as_integer_ratio()
+            return self.from_units(_round_div(self.units * numerator, denominator))
         return NotImplemented
 
     def __rmul__(self, other):
         return self.__mul__(other)
 
     def __truediv__(self, other):
+        if type(other) is int and other and self.units % other == 0:
+            return self.from_units(self.units // other)
         if isinstance(other, (float, int)):
             return type(self)(self.amount / other)
         return NotImplemented
 
 Money.register(Currency('AUD', 2, '$', True).register())
 Money.register(Currency('EUR', 2, '€', False, True).register())
+
+class MoneyFormatter(object):
+
+    r'''Formats amounts of a currency like Currency.format(), but works out the
+    format only once, when constructed.  If 'memo' is true, then it also
+    remembers the text of the most recently formatted amounts.
+    >>> f = MoneyFormatter(Currency.AUD, thousands=True, memo=True)
+    >>> f(Money.AUD(1234.5)), f(-7), f.units(5), f(Money.EUR(2))
+    ('$1,234.50', '$-7.00', '$0.05', '2.00 €')
+    >>> f.column([100, -100])
+    ['$1.00', '$-1.00']
+    '''
+
+    def __init__(self, currency, symbol=True, thousands=False, positive_sign='', positive_prefix='', positive_suffix='', negative_sign='-', negative_prefix='', negative_suffix='', memo=False):
+        self.currency = currency
+        self.options = dict(symbol=symbol, thousands=thousands,
+                            positive_sign=positive_sign, positive_prefix=positive_prefix, positive_suffix=positive_suffix,
+                            negative_sign=negative_sign, negative_prefix=negative_prefix, negative_suffix=negative_suffix)
+        before = after = ''
+        if symbol and currency.local_symbol:
+            sep = ' ' if currency.local_symbol_separated_by_space else ''
+            if currency.local_symbol_precedes:
+                before = currency.local_symbol + sep
+            else:
+                after = sep + currency.local_symbol
+        self._positive = (positive_prefix + before + positive_sign, after + positive_suffix)
+        self._negative = (negative_prefix + before + negative_sign, after + negative_suffix)
+        self._whole = '{0:,}'.format if thousands else str
+        self._memo = {} if memo else None
+
+    def units(self, units):
+        r'''Return the text of the given amount in minor units.
+        '''
+        memo = self._memo
+        if memo is not None:
+            text = memo.get(units)
+            if text is not None:
+                return text
+        prefix, suffix = self._positive if units >= 0 else self._negative
+        digits = self.currency.local_frac_digits
+        if digits:
+            q, r = divmod(abs(units), self.currency.scale)
+            text = prefix + self._whole(q) + '.%0*d' % (digits, r) + suffix
+        else:
+            text = prefix + self._whole(abs(units)) + suffix
+        if memo is not None:
+            if len(memo) >= MONEY_MEMO_SIZE:
+                memo.clear()
+            memo[units] = text
+        return text
+
+    def __call__(self, amount):
+        r'''Return the text of the given Money or number.  Money of another
+        currency is formatted in that currency with the same options.
+        '''
+        if isinstance(amount, Money):
+            if amount.currency is not self.currency and amount.currency != self.currency:
+                return amount.currency.formatter(**self.options).units(amount.units)
+            return self.units(amount.units)
+        return self.units(self.currency.units(amount))
+
+    def column(self, units):
+        r'''Return a list of the texts of all the given amounts in minor units.
+        '''
+        return list(map(self.units, units))
+
+class MoneyVector(object):
+
+    r'''A sequence of amounts of a single currency, held as contiguous 64-bit
+    integers of minor units, for accumulating tallies and columns of reports
+    without making a Money object for every cell at every step.  A vector takes
+    the currency of the first Money added to it; until then it holds plain
+    numbers, which are taken to be whole units of that currency.
+    >>> v = MoneyVector(3)
+    >>> v.add(0, Money.AUD(1.50))
+    >>> v.scatter_add([2, 0, 2], [Money.AUD(-2), 1, Money.AUD(0.25)])
+    >>> v
+    MoneyVector(Currency.AUD, [250, 0, -175])
+    >>> list(v), v.total(), v.total([1]), v.total([])
+    ([Money.AUD(2.50), Money.AUD(0.00), Money.AUD(-1.75)], Money.AUD(0.75), Money.AUD(0.00), 0)
+    >>> v.cumsum().format(thousands=True, symbol=False)
+    ['2.50', '2.50', '0.75']
+    >>> (v + v.gather([2, 2, 0])).format()
+    ['$0.75', '$-1.75', '$0.75']
+    >>> v.format(symbol=False, zero='-')
+    ['2.50', '-', '-1.75']
+    >>> v.add(1, Money.EUR(1))
+    Traceback (most recent call last):
+    abo.money.CurrencyMismatch: MoneyVector(Currency.AUD) + 1.00 EUR
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(v, 2))
+    MoneyVector(Currency.AUD, [250, 0, -175])
+    >>> w = MoneyVector(2)
+    >>> w.add(1, 2.5)
+    >>> w, w.total()
+    (MoneyVector(None, [0, 2.5]), 2.5)
+    >>> w.tagged(Currency.AUD)
+    MoneyVector(Currency.AUD, [0, 250])
+    '''
+
+    __slots__ = ('currency', 'units')
+
+    def __init__(self, length=0, currency=None):
+        self.currency = currency
+        self.units = array.array('q', bytes(8 * length)) if currency is not None else [0] * length
+
+    @classmethod
+    def _from_units(cls, currency, units):
+        self = object.__new__(cls)
+        self.currency = currency
+        self.units = units
+        return self
+
+    def __reduce__(self):
+        return (MoneyVector._from_units, (self.currency, self.units))
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.currency, list(self.units))
+
+    def __len__(self):
+        return len(self.units)
+
+    def _money(self, units):
+        return self.currency.money_factory.from_units(units) if self.currency is not None else units
+
+    def __getitem__(self, index):
+        return self._money(self.units[index])
+
+    def __iter__(self):
+        if self.currency is None:
+            return iter(self.units)
+        from_units = self.currency.money_factory.from_units
+        return (from_units(u) for u in self.units)
+
+    def _tag(self, currency):
+        # Convert the plain numbers held so far into minor units of the given
+        # currency.
+        self.units = array.array('q', (currency.units(n) for n in self.units))
+        self.currency = currency
+
+    def _units(self, amount):
+        if isinstance(amount, Money):
+            if self.currency is None:
+                self._tag(amount.currency)
+            elif amount.currency != self.currency:
+                raise CurrencyMismatch('MoneyVector(%r) + %s' % (self.currency, amount))
+            return amount.units
+        if self.currency is not None:
+            return self.currency.units(amount)
+        return amount
+
+    def append(self, amount):
+        self.units.append(self._units(amount))
+
+    def add(self, index, amount):
+        r'''Add the given amount to the amount at the given index.
+        '''
+        units = self._units(amount)
+        self.units[index] += units
+
+    def scatter_add(self, indices, amounts):
+        r'''Add each of the given amounts, which may be a MoneyVector, to the
+        amount at the corresponding index.
+        '''
+        if isinstance(amounts, MoneyVector):
+            if amounts.currency is None:
+                amounts = amounts.units
+            else:
+                if self.currency is None:
+                    self._tag(amounts.currency)
+                elif amounts.currency != self.currency:
+                    raise CurrencyMismatch('MoneyVector(%r) + MoneyVector(%r)' % (self.currency, amounts.currency))
+                units = self.units
+                for i, u in zip(indices, amounts.units):
+                    units[i] += u
+                return
+        for i, amount in zip(indices, amounts):
+            units = self._units(amount)
+            self.units[i] += units
+
+    def gather(self, indices):
+        r'''Return a new vector of the amounts at the given indices.
+        '''
+        units = self.units
+        gathered = [units[i] for i in indices]
+        return self._from_units(self.currency, array.array('q', gathered) if self.currency is not None else gathered)
+
+    def __add__(self, other):
+        if not isinstance(other, MoneyVector):
+            return NotImplemented
+        assert len(other) == len(self)
+        total = self.gather(range(len(self)))
+        total.scatter_add(range(len(other)), other)
+        return total
+
+    def cumsum(self):
+        r'''Return a new vector of the cumulative sums of the amounts.
+        '''
+        sums = list(itertools.accumulate(self.units))
+        return self._from_units(self.currency, array.array('q', sums) if self.currency is not None else sums)
+
+    def total(self, indices=None):
+        r'''Return the sum of all the amounts, or of those at the given
+        indices, or zero if there are none.
+        '''
+        units = self.units if indices is None else [self.units[i] for i in indices]
+        if not units:
+            return 0
+        return self._money(sum(units))
+
+    def tagged(self, currency):
+        r'''Return this vector, or if it has no currency yet, a copy of it in
+        the given currency.
+        '''
+        if self.currency is not None:
+            return self
+        copy = self.gather(range(len(self)))
+        copy._tag(currency)
+        return copy
+
+    def format(self, zero=None, **kwargs):
+        r'''Return a list of the string representations of all the amounts, as
+        formatted by Money.format(), with zero amounts replaced by the given
+        text if any.
+        '''
+        assert self.currency is not None
+        texts = self.currency.format_units(self.units, **kwargs)
+        if zero is not None:
+            texts = [zero if u == 0 else t for u, t in zip(self.units, texts)]
+        return texts
@@ -0,0 +1,324 @@
+# vim: sw=4 sts=4 et fileencoding=utf8 nomod
+#
+# Copyright 2014 Andrew Bettison
+
+"""A long-running server process that keeps the chart of accounts and all
+transactions resident in memory, and executes commands on behalf of clients
+connected through a UNIX socket in the cache directory.
+
+Each request is a single JSON line containing the client's arguments, working
+directory, environment and whether its standard output is a terminal.  The
+server replies with a sequence of JSON lines, each an ["out", text] or ["err",
+text] pair that the client copies to its standard output or error, ending with
+an ["exit", status] pair.
+"""
+
+if __name__ == "__main__":
+    import sys
+    if sys.path[0] == sys.path[1] + '/abo':
+        del sys.path[0]
+    import doctest
+    import abo.server
+    doctest.testmod(abo.server)
+
+import os
+import os.path
+import sys
+import errno
+import socket
+import json
+import hashlib
+import logging
+import signal
+import traceback
+
+class ServerException(Exception):
+    pass
+
+def socket_path(config):
+    r"""Return the path of the server socket for the given configuration.  The
+    cache directory may be shared by many account systems, so the socket name
+    is derived from the base directory.
+    """
+    ident = hashlib.md5(os.path.abspath(config.base_dir_path).encode('utf8')).hexdigest()[:16]
+    return os.path.abspath(os.path.join(config.cache_dir_path, 'serve-%s.sock' % ident))
+
+def forward(config, argv):
+    r"""If a server is running for the given configuration, and the ABO_NOSERVE
+    environment variable is not set, execute the command given by argv in the
+    server, copying its output to sys.stdout and sys.stderr, and return its
+    exit status.  Otherwise return None.
+    """
+    if os.environ.get('ABO_NOSERVE'):
+        return None
+    path = socket_path(config)
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        sock.close()
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        return None
+    with sock:
+        request = {'argv': list(argv),
+                   'cwd': os.getcwd(),
+                   'env': dict(os.environ),
+                   'isatty': sys.stdout.isatty()}
+        sock.sendall(json.dumps(request).encode('utf8') + b'\n')
+        streams = {'out': sys.stdout, 'err': sys.stderr}
+        for line in sock.makefile('r', encoding='utf8'):
+            kind, value = json.loads(line)
+            if kind == 'exit':
+                return value
+            streams[kind].write(value)
+    print("%s: server closed connection" % (os.path.basename(sys.argv[0]),), file=sys.stderr)
+    return 1
+
+class _Stream(object):
+
+    r"""A text output stream that sends its content to a client as frames of a
+    given kind.
+    """
+
+    def __init__(self, conn, kind, tty):
+        self.conn = conn
+        self.kind = kind
+        self.tty = tty
+        self.buf = []
+        self.size = 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= 8192:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.buf:
+            text = ''.join(self.buf)
+            self.buf = []
+            self.size = 0
+            self.conn.sendall(json.dumps([self.kind, text]).encode('utf8') + b'\n')
+
+class Server(object):
+
+    r"""Accept connections on the server socket.  Before each command, bring the
+    resident chart and transactions up to date, then fork a child process to
+    execute the client's command by calling execute(argv) with sys.stdout,
+    sys.stderr, the working directory and the environment replaced by the
+    client's.  Commands are free to modify the chart and transactions (eg, by
+    adding accounts), because those changes vanish with the child.
+    """
+
+    def __init__(self, config, execute):
+        self.config = config
+        self.execute = execute
+        self.path = socket_path(config)
+        self.children = set()
+
+    def bind(self):
+        try:
+            os.mkdir(self.config.cache_dir_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.path):
+            try:
+                self.sock.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                self.sock.close()
+                raise ServerException('server already running: %s' % (self.path,))
+            self.sock.close()
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(16)
+        logging.info("serving on %r", self.path)
+
+    def serve_forever(self):
+        self.bind()
+        try:
+            while True:
+                conn, addr = self.sock.accept()
+                self.reap()
+                with conn:
+                    self.prepare()
+                    pid = os.fork()
+                    if pid == 0:
+                        status = 1
+                        try:
+                            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                            self.sock.close()
+                            status = self.handle(conn)
+                        except (BrokenPipeError, ConnectionResetError):
+                            pass
+                        except:
+                            traceback.print_exc()
+                        finally:
+                            try:
+                                import abo.cache
+                                abo.cache.flush_stats()
+                            finally:
+                                os._exit(status)
+                    self.children.add(pid)
+        finally:
+            self.sock.close()
+            os.unlink(self.path)
+
+    def reap(self):
+        for pid in list(self.children):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                self.children.discard(pid)
+
+    def prepare(self):
+        import abo.config
+        import abo.cache
+        import abo.timing
+        # The child process reports the timings of this preparation as part
+        # of its command.
+        abo.timing.reset()
+        try:
+            config = abo.config.Config().load()
+            abo.cache.refresh(config)
+            abo.cache.chart(config)
+            abo.cache.all_transactions(config)
+        except Exception as e:
+            # Let the child process report the error to the client.
+            logging.debug("prepare: %s", e)
+        # Do not let the child process count these events again.
+        abo.cache.flush_stats()
+
+    def handle(self, conn):
+        request = json.loads(conn.makefile('r', encoding='utf8').readline())
+        logging.debug("request %r", request['argv'])
+        out = _Stream(conn, 'out', request['isatty'])
+        err = _Stream(conn, 'err', False)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.stdout, sys.stderr = out, err
+        for h in logging.root.handlers:
+            if isinstance(h, logging.StreamHandler):
+                h.setStream(err)
+        status = 0
+        try:
+            self.execute(request['argv'])
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=err)
+                status = 1
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception:
+            traceback.print_exc(file=err)
+            status = 1
+        out.flush()
+        err.flush()
+        conn.sendall(json.dumps(['exit', status]).encode('utf8') + b'\n')
+        return status
+
+def serve(config, opts, execute):
+    r"""Load the chart and all transactions into memory, then serve commands
+    until interrupted.
+    """
+    import abo.cache
+    abo.cache.chart(config, opts)
+    abo.cache.all_transactions(config, opts)
+    # Remove the socket when terminated.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        Server(config, execute).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+__test__ = {
+'serve':r"""
+
+A server keeps the transactions of an account system resident, and executes
+the commands forwarded to it by clients:
+
+>>> import tempfile, time, io, abo.config, abo.cache
+>>> base = tempfile.mkdtemp()
+>>> for name, text in (('.pyabo', 'journal *.jnl ;\ncache-dir cache ;\n'),
+...                    ('accounts', 'Food [food]\nBank [bank]\n'),
+...                    ('a.jnl', '1/3/2013 something\n food  10.00\n bank\n')):
+...     with open(os.path.join(base, name), 'w') as f:
+...         _ = f.write(text)
+>>> cwd = os.getcwd()
+>>> os.chdir(base)
+>>> config = abo.config.Config().load()
+>>> def execute(argv):
+...     if argv == ['total']:
+...         print(sum(t.amount() for t in abo.cache.all_transactions(abo.config.Config().load())))
+...     elif argv == ['fail']:
+...         raise ValueError('failed')
+...     elif argv == ['exit']:
+...         sys.exit(3)
+>>> forward(config, ['total']) is None
+True
+>>> pid = os.fork()
+>>> if pid == 0:
+...     try:
+...         serve(config, None, execute)
+...     finally:
+...         os._exit(0)
+>>> while not os.path.exists(socket_path(config)):
+...     time.sleep(0.01)
+>>> forward(config, ['total'])
+10.00 AUD
+0
+
+Before every command, the server reloads any journal that has changed:
+
+>>> with open('a.jnl', 'a') as f:
+...     _ = f.write('\n2/3/2013 another\n food  5.00\n bank\n')
+>>> forward(config, ['total'])
+15.00 AUD
+0
+
+A command's exit status is returned, and any exception it raises is reported
+to the client as an error:
+
+>>> forward(config, ['exit'])
+3
+>>> stderr, sys.stderr = sys.stderr, io.StringIO()
+>>> status, err = forward(config, ['fail']), sys.stderr.getvalue()
+>>> sys.stderr = stderr
+>>> status, err.splitlines()[0], err.splitlines()[-1]
+(1, 'Traceback (most recent call last):', 'ValueError: failed')
+
+Commands are not forwarded if ABO_NOSERVE is set:
+
+>>> os.environ['ABO_NOSERVE'] = '1'
+>>> forward(config, ['total']) is None
+True
+>>> del os.environ['ABO_NOSERVE']
+
+When terminated, the server removes its socket:
+
+>>> os.kill(pid, signal.SIGTERM)
+>>> os.waitpid(pid, 0)[1]
+0
+>>> os.path.exists(socket_path(config)), forward(config, ['total'])
+(False, None)
+>>> os.chdir(cwd)
+
+""",
+}
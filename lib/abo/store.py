@@ -0,0 +1,341 @@
+# vim: sw=4 sts=4 et fileencoding=utf8 nomod
+#
+# Copyright 2014 Andrew Bettison
+
+r"""A TransactionStore is a compact, columnar, memory-mapped file of
+Transactions, which are decoded lazily as they are accessed, so that the cost
+of loading a store is proportional to what is used, not to its size.
+
+Dates are stored as ordinals, amounts as integers in minor units of their
+currency, and all text (who, what, tags, account names, details) as indices
+into a table of unique strings.  Columns are in native byte order, so a store
+is only portable between machines of the same architecture, which suffices for
+a cache.
+
+>>> import datetime
+>>> import abo.money
+>>> AUD = abo.money.Money.AUD
+>>> t1 = Transaction(date=datetime.date(2013, 3, 16), who="Somebody", what="something",
+...         entries=({'account':'a1', 'amount':AUD(-21.90), 'detail':'a debit'},
+...                  {'account':'a2', 'amount':AUD(21.90), 'cdate':datetime.date(2013, 4, 1)}))
+>>> t2 = Transaction(date=datetime.date(2013, 3, 17), edate=datetime.date(2013, 1, 1),
+...         what="another", tags=('one', 'two'), is_projection=True,
+...         entries=({'account':'a1', 'amount':AUD(100)},
+...                  {'account':'a3', 'amount':AUD(-60)},
+...                  {'account':'a2', 'amount':AUD(-40)}))
+>>> import tempfile, os.path
+>>> path = os.path.join(tempfile.mkdtemp(), 'store')
+>>> k1 = bytes(range(15)) + b'\0'
+>>> write(path, [t1, t2], block_keys=[k1, None], meta={'wild_names': ['a2']})
+>>> s = TransactionStore(path)
+>>> len(s)
+2
+>>> s[0] #doctest: +NORMALIZE_WHITESPACE
+StoredTransaction(date=datetime.date(2013, 3, 16), who='Somebody', what='something',
+    entries=(Entry(account='a1', amount=Money.AUD(-21.90), detail='a debit'),
+             Entry(account='a2', amount=Money.AUD(21.90), cdate=datetime.date(2013, 4, 1))))
+>>> s[1] #doctest: +NORMALIZE_WHITESPACE
+StoredTransaction(date=datetime.date(2013, 3, 17), edate=datetime.date(2013, 1, 1),
+    what='another', tags=('one', 'two'),
+    entries=(Entry(account='a3', amount=Money.AUD(-60.00)),
+             Entry(account='a2', amount=Money.AUD(-40.00)),
+             Entry(account='a1', amount=Money.AUD(100.00))))
+>>> s[1].is_projection, s[1].amount()
+(True, Money.AUD(100.00))
+>>> s[1] is s[1], s[1].entries[0].transaction is s[1]
+(True, True)
+>>> s.block_keys() == [k1, None]
+True
+>>> write(path, [t1, t2], block_keys=[bytes(16), b'short'])
+Traceback (most recent call last):
+abo.store.StoreError: cannot store block key b'short'
+>>> write(path, [t1, t2], block_keys=[None, bytes(16)])
+>>> TransactionStore(path).block_keys() == [None, bytes(16)]
+True
+>>> s.meta
+{'wild_names': ['a2']}
+>>> sorted(s.account_names())
+['a1', 'a2', 'a3']
+
+A store pickles as a reference to its file:
+
+>>> import pickle
+>>> s2 = pickle.loads(pickle.dumps(s, 2))
+>>> s2.path == path, s2[0].who
+(True, 'Somebody')
+"""
+
+if __name__ == "__main__":
+    import sys
+    if sys.path[0] == sys.path[1] + '/abo':
+        del sys.path[0]
+    import doctest
+    import abo.store
+    doctest.testmod(abo.store)
+
+import os
+import os.path
+import mmap
+import array
+import struct
+import json
+import datetime
+import functools
+import collections.abc
+import abo.money
+from abo.transaction import Transaction, Entry
+
+MAGIC = b'ABOSTOR3'
+
+BLOCK_KEY_SIZE = 16
+
+# The sections of a store, in file order, with their array type codes.
+SECTIONS = (
+    ('t_date', 'i'),
+    ('t_edate', 'i'),
+    ('t_who', 'i'),
+    ('t_what', 'i'),
+    ('t_tags', 'i'),
+    ('t_projection', 'b'),
+    ('t_currency', 'i'),
+    ('t_amount', 'q'),
+    ('t_first', 'i'),           # index of first entry; one extra for the end
+    ('t_keyed', 'b'),           # 1 if the transaction has a block key
+    ('t_block_key', 'B'),       # BLOCK_KEY_SIZE bytes per transaction
+    ('e_account', 'i'),
+    ('e_currency', 'i'),
+    ('e_amount', 'q'),
+    ('e_cdate', 'i'),
+    ('e_detail', 'i'),
+    ('s_offset', 'q'),          # offset of each string; one extra for the end
+    ('s_text', 'B'),            # UTF-8 text of all strings
+    ('m_json', 'B'),            # JSON-encoded metadata
+)
+
+_header = struct.Struct('=8sq' + 'qq' * len(SECTIONS))
+
+class StoreError(Exception):
+    pass
+
+def write(path, transactions, block_keys=None, meta=None):
+    r"""Write the given Transactions, and optionally a block key (see
+    abo.journal) of BLOCK_KEY_SIZE bytes or None for each and a dict of
+    JSON-serialisable metadata, to a new store file at the given path,
+    replacing any existing file atomically, so that any process that has the
+    old file mapped is unaffected.
+    """
+    columns = dict((name, array.array(code)) for name, code in SECTIONS)
+    strings = {}
+    texts = []
+    def sid(text):
+        if text is None:
+            return -1
+        i = strings.get(text)
+        if i is None:
+            i = strings[text] = len(texts)
+            texts.append(text.encode('utf8'))
+        return i
+    def minor_units(money):
+        if not isinstance(money, abo.money.Money):
+            raise StoreError('cannot store amount %r' % (money,))
+        return money.units, sid(money.currency.code)
+    block_keys = list(block_keys) if block_keys is not None else []
+    for i, t in enumerate(transactions):
+        if not isinstance(t.date, datetime.date):
+            raise StoreError('cannot store date %r' % (t.date,))
+        columns['t_date'].append(t.date.toordinal())
+        columns['t_edate'].append(t.edate.toordinal())
+        columns['t_who'].append(sid(t.who))
+        columns['t_what'].append(sid(t.what))
+        columns['t_tags'].append(sid('\n'.join(sorted(t.tags))) if t.tags else -1)
+        columns['t_projection'].append(1 if t.is_projection else 0)
+        units, currency = minor_units(t.amount())
+        columns['t_currency'].append(currency)
+        columns['t_amount'].append(units)
+        columns['t_first'].append(len(columns['e_account']))
+        key = block_keys[i] if i < len(block_keys) else None
+        if key is not None and len(key) != BLOCK_KEY_SIZE:
+            raise StoreError('cannot store block key %r' % (key,))
+        columns['t_keyed'].append(0 if key is None else 1)
+        columns['t_block_key'].frombytes(bytes(BLOCK_KEY_SIZE) if key is None else key)
+        for e in t.entries:
+            columns['e_account'].append(sid(e.account))
+            units, currency = minor_units(e.amount)
+            columns['e_currency'].append(currency)
+            columns['e_amount'].append(units)
+            columns['e_cdate'].append(e.cdate.toordinal() if e.cdate else 0)
+            columns['e_detail'].append(sid(e.detail))
+    columns['t_first'].append(len(columns['e_account']))
+    offset = 0
+    for text in texts:
+        columns['s_offset'].append(offset)
+        offset += len(text)
+    columns['s_offset'].append(offset)
+    columns['s_text'].frombytes(b''.join(texts))
+    columns['m_json'].frombytes(json.dumps(meta or {}).encode('utf8'))
+    layout = []
+    offset = _header.size
+    for name, code in SECTIONS:
+        offset += -offset % 8
+        layout += [offset, len(columns[name])]
+        offset += len(columns[name]) * columns[name].itemsize
+    tmppath = '%s.%u.tmp' % (path, os.getpid())
+    try:
+        with open(tmppath, 'wb') as f:
+            f.write(_header.pack(MAGIC, len(SECTIONS), *layout))
+            for name, code in SECTIONS:
+                f.write(b'\0' * (-f.tell() % 8))
+                columns[name].tofile(f)
+        os.replace(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+
+def _open(path):
+    return TransactionStore(path)
+
+class TransactionStore(collections.abc.Sequence):
+
+    r"""A read-only sequence of StoredTransaction objects backed by a store file.
+    Each transaction is only decoded when accessed, and thereafter is always
+    the same object.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._mmap[:len(MAGIC)]
+        if magic != MAGIC:
+            if magic[:-1] == MAGIC[:-1]:
+                raise StoreError('%s: unsupported store version' % (path,))
+            raise StoreError('%s: not a store' % (path,))
+        if len(self._mmap) < _header.size:
+            raise StoreError('%s: truncated store' % (path,))
+        fields = _header.unpack_from(self._mmap)
+        if fields[1] != len(SECTIONS):
+            raise StoreError('%s: not a store' % (path,))
+        buf = memoryview(self._mmap)
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, count = fields[2 + i * 2], fields[3 + i * 2]
+            size = array.array(code).itemsize
+            if offset + count * size > len(self._mmap):
+                raise StoreError('%s: truncated store' % (path,))
+            setattr(self, name, buf[offset:offset + count * size].cast(code))
+        self._count = len(self.t_date)
+        self._transactions = [None] * self._count
+        self._strings = {-1: None}
+        self._tags = {-1: frozenset()}
+        self._factories = {}
+        self.meta = json.loads(bytes(self.m_json).decode('utf8'))
+
+    def __reduce__(self):
+        return (_open, (self.path,))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        t = self._transactions[index]
+        if t is None:
+            if index < 0:
+                index += self._count
+            t = self._transactions[index] = StoredTransaction(self, index)
+        return t
+
+    def block_keys(self):
+        keys = []
+        raw = self.t_block_key
+        for i in range(self._count):
+            keys.append(bytes(raw[i * BLOCK_KEY_SIZE:(i + 1) * BLOCK_KEY_SIZE]) if self.t_keyed[i] else None)
+        return keys
+
+    def account_names(self):
+        r"""Return the set of names of all the accounts of all entries.
+        """
+        return set(self.string(i) for i in set(self.e_account))
+
+    def string(self, i):
+        try:
+            return self._strings[i]
+        except KeyError:
+            text = self._strings[i] = bytes(self.s_text[self.s_offset[i]:self.s_offset[i + 1]]).decode('utf8')
+            return text
+
+    def tags(self, i):
+        try:
+            return self._tags[i]
+        except KeyError:
+            tags = self._tags[i] = frozenset(self.string(i).split('\n'))
+            return tags
+
+    def money(self, currency, units):
+        factory = self._factories.get(currency)
+        if factory is None:
+            factory = self._factories[currency] = getattr(abo.money.Money, self.string(currency))
+        return factory.from_units(units)
+
+def _date(ordinal):
+    return datetime.date.fromordinal(ordinal) if ordinal else None
+
+class StoredTransaction(Transaction):
+
+    r"""A Transaction whose attributes are decoded from a TransactionStore when
+    first accessed.
+    """
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __reduce__(self):
+        return (self._store.__getitem__, (self._index,))
+
+    @functools.cached_property
+    def date(self):
+        return _date(self._store.t_date[self._index])
+
+    @functools.cached_property
+    def edate(self):
+        return _date(self._store.t_edate[self._index])
+
+    @functools.cached_property
+    def who(self):
+        return self._store.string(self._store.t_who[self._index])
+
+    @functools.cached_property
+    def what(self):
+        return self._store.string(self._store.t_what[self._index])
+
+    @functools.cached_property
+    def tags(self):
+        return self._store.tags(self._store.t_tags[self._index])
+
+    @functools.cached_property
+    def is_projection(self):
+        return bool(self._store.t_projection[self._index])
+
+    @functools.cached_property
+    def entries(self):
+        s = self._store
+        return tuple(Entry(self,
+                           account= s.string(s.e_account[i]),
+                           amount= s.money(s.e_currency[i], s.e_amount[i]),
+                           cdate= _date(s.e_cdate[i]),
+                           detail= s.string(s.e_detail[i]))
+                     for i in range(s.t_first[self._index], s.t_first[self._index + 1]))
+
+    def amount(self):
+        s = self._store
+        return s.money(s.t_currency[self._index], s.t_amount[self._index])
+
+    def replace(self, date=None, entries=None):
+        return Transaction(
+                date= self.date if date is None else date,
+                who= self.who,
+                what= self.what,
+                entries= self.entries if entries is None else list(entries)
+            )
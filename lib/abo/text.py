@@ -14,9 +14,9 @@ if __name__ == "__main__":
     doctest.testmod(abo.text)
 
 def number_lines(lines, name=None, start=1):
-    '''Iterate over the given lines, transforming them into numbered_line
-    objects with name and line_number attributes.  Interpret input lines
-    starting with "#line " specially.
+    '''Iterate over the given lines, transforming them into Line objects with
+    name and line_number attributes.  Interpret input lines starting with
+    "#line " specially.
     >>> nl = list(number_lines(['a', 'b', '#line 8 bar', 'c'], name='foo'))
     >>> len(nl)
     3
@@ -35,7 +35,7 @@ def number_lines(lines, name=None, start=1):
     '''
     if name is None and hasattr(lines, 'name'):
         name = lines.name
-    lnum = 0
+    lnum = start - 1
     for line in lines:
         lnum += 1
         if line.startswith('#line '):
@@ -45,123 +45,37 @@ def number_lines(lines, name=None, start=1):
                 if len(words) >= 2:
                     name = words[1]
         else:
-            nline = numbered_line(line)
-            nline.line_number = lnum
-            nline.name = name
-            yield nline
-
-class numbered_line(str):
-
-    r'''Sub-class of str which carries extra attributes such as 'line_number'
-    and 'name', which it preserves where needed.
-
-    >>> i = numbered_line(' abc ')
-    >>> i.line_number = 42
-    >>> i.name = 'wah'
-    >>> i.lstrip()
-    'abc '
-    >>> type(i.lstrip())
-    <class 'abo.text.numbered_line'>
-    >>> i.lstrip().line_number
-    42
-    >>> i.lstrip().name
-    'wah'
-    >>> i.rstrip()
-    ' abc'
-    >>> type(i.rstrip())
-    <class 'abo.text.numbered_line'>
-    >>> i.rstrip().line_number
-    42
-    >>> i.rstrip().name
-    'wah'
-    >>> i[2]
-    'b'
-    >>> i[2].name
-    'wah'
-    >>> i[3:]
-    'c '
-    >>> i[3:].name
-    'wah'
-    >>> i + 'def'
-    ' abc def'
-    >>> (i + 'def').name
-    'wah'
-    >>> 'xxx' + i
-    'xxx abc '
-    >>> ('xxx' + i).name
-    'wah'
-
-    >>> j = numbered_line('a b cde fgh ')
-    >>> j.name = 'wah'
-    >>> j.split(None, 2)
-    ['a', 'b', 'cde fgh ']
-    >>> j.split(None, 2)[2].name
-    'wah'
-
-    Cannot pickle instances of numbered_line:
-
-    >>> import abo.text
-    >>> i = abo.text.numbered_line('xyz')
-    >>> import pickle
-    >>> pickle.dumps(i, 0)
-    Traceback (most recent call last):
-    _pickle.PicklingError: cannot pickle 'xyz' with type <class 'abo.text.numbered_line'>
-    >>> pickle.dumps(i, 1)
-    Traceback (most recent call last):
-    _pickle.PicklingError: cannot pickle 'xyz' with type <class 'abo.text.numbered_line'>
-    >>> pickle.dumps(i, 2)
-    Traceback (most recent call last):
-    _pickle.PicklingError: cannot pickle 'xyz' with type <class 'abo.text.numbered_line'>
-
-    '''
-
-    def __new__(cls, arg=''):
-        if isinstance(arg, cls):
-            return arg
-        self = super(numbered_line, cls).__new__(cls, arg)
-        if isinstance(arg, cls):
-            self.__dict__.update(arg.__dict__)
-        return self
+            yield Line(line, name, lnum)
 
-    def __getstate__(self):
-        import pickle
-        raise pickle.PicklingError('cannot pickle %r with type %r' % (self, type(self)))
+class Line(object):
 
-    def __getnewargs__(self):
-        import pickle
-        raise pickle.PicklingError('cannot pickle %r with type %r' % (self, type(self)))
+    r'''A line of text, in the 'string' attribute, with the name of its source
+    and its line number, for use in error messages.  Parsers operate on the
+    string, which is an ordinary str, and refer to the Line only to report an
+    error, so no string operation need preserve the location.
 
-    def __wrap(self, value):
-        obj = type(self)(value)
-        obj.__dict__.update(self.__dict__)
-        return obj
+    >>> i = Line(' abc ', 'wah', 42)
+    >>> i
+    ' abc '
+    >>> str(i), i.name, i.line_number
+    (' abc ', 'wah', 42)
+    >>> context_prefix(i)
+    'wah, 42: '
 
-    def strip(self, chars=None):
-        return self.__wrap(super(numbered_line, self).strip(chars))
-
-    def rstrip(self, chars=None):
-        return self.__wrap(super(numbered_line, self).rstrip(chars))
-
-    def lstrip(self, chars=None):
-        return self.__wrap(super(numbered_line, self).lstrip(chars))
-
-    def __getitem__(self, key):
-        return self.__wrap(super(numbered_line, self).__getitem__(key))
+    '''
 
-    def __getslice__(self, i, j):
-        return self.__wrap(super(numbered_line, self).__getslice__(i, j))
+    __slots__ = ('string', 'name', 'line_number', 'indent')
 
-    def __add__(self, other):
-        return self.__wrap(super(numbered_line, self).__add__(other))
-        
-    def __radd__(self, other):
-        return self.__wrap(other.__add__(self))
+    def __init__(self, string, name=None, line_number=None):
+        self.string = string
+        self.name = name
+        self.line_number = line_number
 
-    def split(self, *args):
-        return list(map(self.__wrap, super(numbered_line, self).split(*args)))
+    def __str__(self):
+        return self.string
 
-    def rsplit(self, *args):
-        return list(map(self.__wrap, super(numbered_line, self).rsplit(*args)))
+    def __repr__(self):
+        return repr(self.string)
 
 class LineError(ValueError):
 
@@ -175,9 +89,9 @@ class LineError(ValueError):
 
 def context_prefix(line, suffix=': '):
     r = []
-    if hasattr(line, 'name'):
+    if getattr(line, 'name', None) is not None:
         r.append(str(line.name))
-    if hasattr(line, 'line_number'):
+    if getattr(line, 'line_number', None) is not None:
         r.append(str(line.line_number))
     return ', '.join(r) + (suffix if r else '')
 
@@ -190,17 +104,19 @@ def raise_with_context(line):
     raise
 
 def line_blocks(lines):
-    r"""Return an iterator over blocks of lines, where a block is a contiguous
+    r"""Return an iterator over blocks of Lines, where a block is a contiguous
     sequence of non-empty lines delimited by start file or end file or one or
     more blank lines.
-    >>> list(line_blocks(['a', 'b', '', 'c', 'd']))
+    >>> list(line_blocks(number_lines(['a', 'b', '', 'c', 'd'])))
     [['a', 'b'], ['c', 'd']]
     """
     block = []
     for line in lines:
-        line = line.rstrip('\n')
-        if line:
-            if not line.startswith('#'):
+        text = line.string
+        if text.endswith('\n'):
+            text = line.string = text.rstrip('\n')
+        if text:
+            if not text.startswith('#'):
                 block.append(line)
         elif block:
             yield block
@@ -209,25 +125,26 @@ def line_blocks(lines):
         yield block
 
 def undent_lines(lines):
-    r"""Return an iterator over lines with the 'indent' attribute set to the
-    logical indent level, starting at zero.
-    >>> lines = map(numbered_line, ['  abc', 'def', ' ghi', '  jkl', '   mno', ' pqr', 'stu'])
+    r"""Return an iterator over Lines, stripped of leading white space, with
+    the 'indent' attribute set to the logical indent level, starting at zero.
+    >>> lines = number_lines(['  abc', 'def', ' ghi', '  jkl', '   mno', ' pqr', 'stu'], name='x')
     >>> il = list(undent_lines(lines))
     >>> il
     ['abc', 'def', 'ghi', 'jkl', 'mno', 'pqr', 'stu']
     >>> [i.indent for i in il]
     [1, 0, 1, 2, 3, 1, 0]
-    >>> lines = map(numbered_line, ['  abc', ' def'])
+    >>> lines = number_lines(['  abc', ' def'], name='x')
     >>> list(undent_lines(lines))
     Traceback (most recent call last):
-    abo.text.LineError: invalid indent
+    abo.text.LineError: x, 2: invalid indent
     """
     indent = []
     for line in lines:
-        iline = line.lstrip()
-        if not line or line.startswith('#'):
+        text = line.string
+        itext = text.lstrip()
+        if not text or text.startswith('#'):
             continue
-        sp = line[:-len(iline)]
+        sp = text[:-len(itext)]
         if not sp:
             indent = []
         elif indent:
@@ -242,6 +159,6 @@ def undent_lines(lines):
                 raise LineError('invalid indent', line=line)
         elif sp:
             indent.append(sp)
-
-        iline.indent = len(indent)
-        yield iline
+        line.string = itext
+        line.indent = len(indent)
+        yield line
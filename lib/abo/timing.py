@@ -0,0 +1,145 @@
+# vim: sw=4 sts=4 et fileencoding=utf8 nomod
+#
+# Copyright 2014 Andrew Bettison
+
+r"""Timings of the phases of a command, such as checking and loading caches,
+compiling journals, sorting, generating a report and writing its output, to
+show where the time goes.
+
+The time of a phase excludes any phase nested within it, so the times of all
+phases in a process add up to no more than its elapsed time.  Phases timed in
+worker processes are merged into their parent, so they may add up to more.
+
+>>> import itertools
+>>> _reset(clock=itertools.count().__next__)
+>>> with phase('load', 'a'):
+...     with phase('compile', 'a'):
+...         pass
+>>> list(timed('report', ['x', 'y']))
+['x', 'y']
+>>> entries()
+[('compile', 'a', 1), ('load', 'a', 2), ('report', None, 3)]
+>>> for line in summary(): print(line)
+phase       count  seconds
+compile         1    1.000
+load            1    2.000
+report          1    3.000
+"""
+
+if __name__ == "__main__":
+    import sys
+    if sys.path[0] == sys.path[1] + '/abo':
+        del sys.path[0]
+    import doctest
+    import abo.timing
+    doctest.testmod(abo.timing)
+
+import time
+import json
+import logging
+import contextlib
+from collections import OrderedDict
+
+_clock = time.perf_counter
+_start = _clock()
+_entries = []
+_stack = []
+
+def _reset(clock=None):
+    global _clock, _start, _entries, _stack
+    if clock is not None:
+        _clock = clock
+    _start = _clock()
+    _entries = []
+    _stack = []
+
+def reset():
+    r"""Discard all timings recorded so far, and start timing anew, eg, at the
+    start of a command executed by a long-running process.
+    """
+    _reset()
+
+def _push():
+    frame = [_clock(), 0]
+    _stack.append(frame)
+    return frame
+
+def _pop(frame):
+    assert _stack and _stack[-1] is frame
+    _stack.pop()
+    elapsed = _clock() - frame[0]
+    if _stack:
+        _stack[-1][1] += elapsed
+    return elapsed - frame[1]
+
+@contextlib.contextmanager
+def phase(name, detail=None):
+    frame = _push()
+    try:
+        yield
+    finally:
+        record(name, _pop(frame), detail)
+
+def timed(name, iterable, detail=None):
+    r"""Iterate over the given iterable, recording the total time taken to
+    produce its items as a single phase.
+    """
+    iterator = iter(iterable)
+    seconds = 0
+    try:
+        while True:
+            frame = _push()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += _pop(frame)
+            yield item
+    finally:
+        record(name, seconds, detail)
+
+def record(name, seconds, detail=None):
+    _entries.append((name, detail, seconds))
+
+def entries():
+    return list(_entries)
+
+def merge(entries):
+    r"""Add the given timings, as returned by entries() in another process, to
+    the timings of this process.
+    """
+    _entries.extend(entries)
+
+def totals():
+    totals = OrderedDict()
+    for name, detail, seconds in _entries:
+        count, total = totals.get(name, (0, 0))
+        totals[name] = (count + 1, total + seconds)
+    return totals
+
+def summary():
+    r"""Return the lines of a table of the number and total time of every
+    phase.
+    """
+    fmt = '%-10s %6s %8s'
+    yield fmt % ('phase', 'count', 'seconds')
+    for name, (count, seconds) in totals().items():
+        yield fmt % (name, count, '%.3f' % seconds)
+
+def log(path, argv):
+    r"""Append the timings of the command with the given arguments to the
+    given file as a single JSON line.
+    """
+    line = json.dumps({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'argv': argv,
+            'elapsed': _clock() - _start,
+            'totals': totals(),
+            'entries': _entries,
+        })
+    try:
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+    except OSError as e:
+        logging.warning("cannot log timings to %r: %s" % (path, e))
@@ -47,6 +47,7 @@ if __name__ == "__main__":
     doctest.testmod(abo.transaction, optionflags= doctest.ELLIPSIS)
 
 import re
+import sys
 import datetime
 from itertools import chain
 from collections import defaultdict
@@ -60,6 +61,8 @@ class Entry(abo.base.Base):
     single account.
     """
 
+    __slots__ = ('transaction', 'account', 'amount', 'cdate', 'detail', '_chart', '_chart_account')
+
     def __init__(self, transaction, account=None, amount=None, cdate=None, detail=""):
         """Construct a new Entry object, given its account, amount (-ve for
         debit, +ve for credit), and optional descriptive detail.
@@ -68,10 +71,11 @@ class Entry(abo.base.Base):
         assert amount is not None, 'missing amount'
         assert amount != 0, 'zero amount: account=%r cdate=%r detail=%r' % (account, cdate, detail)
         self.transaction = transaction
-        self.account = str(account)
+        self.account = _intern(str(account))
         self.amount = amount
         self.cdate = cdate
-        self.detail = str(detail) if detail is not None else None
+        self.detail = _intern(str(detail)) if detail else detail
+        self._chart = None
 
     def __repr__(self):
         r = []
@@ -111,6 +115,35 @@ class Entry(abo.base.Base):
             return NotImplemented
         return not (self == other)
 
+    def __reduce__(self):
+        # An Entry pickles as a reference into its Transaction, which pickles
+        # its entries compactly (see Transaction.__reduce__).  The account
+        # resolved by resolve() belongs to a chart in memory, so is not
+        # pickled, and is resolved again after unpickling.
+        if self.transaction is not None:
+            return (_transaction_entry, (self.transaction, [id(e) for e in self.transaction.entries].index(id(self))))
+        return (Entry, (None, self.account, self.amount, self.cdate, self.detail))
+
+    def resolve(self, chart):
+        r"""Return the Account of this entry in the given chart, which is only
+        looked up the first time, so that the many reports of a long-running
+        process need not look up every entry again.
+        >>> import abo.account
+        >>> chart = abo.account.Chart.from_file('a1\na2\n')
+        >>> t = Transaction(date=1, entries=({'account':':a1', 'amount':1}, {'account':':a2', 'amount':-1}))
+        >>> e = t.entries[0]
+        >>> e.resolve(chart) is chart[':a2'] and e.resolve(chart) is e.resolve(chart)
+        True
+        >>> import pickle
+        >>> e2 = pickle.loads(pickle.dumps(t, 2)).entries[0]
+        >>> e._chart is chart, e2._chart is None, e2.resolve(chart) is chart[':a2']
+        (True, True, True)
+        """
+        if self._chart is not chart:
+            self._chart_account = chart[self.account]
+            self._chart = chart
+        return self._chart_account
+
     def _attach(self, transaction):
         """Return an Entry object that is identical to this one, attached to
         the given Transaction object.  Since Entry objects are immutable, if
@@ -274,16 +307,16 @@ class Entry(abo.base.Base):
     # Interface used by predicate functions:
 
     def is_called(self, chart, name):
-        return chart[self.account].is_called(chart, name)
+        return self.resolve(chart).is_called(chart, name)
 
     def is_tagged(self, chart, tag):
-        return tag in self.transaction.tags or chart[self.account].is_tagged(chart, tag)
+        return tag in self.transaction.tags or self.resolve(chart).is_tagged(chart, tag)
 
     def is_matching(self, chart, pattern):
-        return chart[self.account].is_matching(chart, pattern)
+        return self.resolve(chart).is_matching(chart, pattern)
 
     def is_within(self, chart, other):
-        return chart[self.account].is_within(chart, other)
+        return self.resolve(chart).is_within(chart, other)
 
 class Transaction(abo.base.Base):
     """A Transaction is an immutable object that has a date, an optional
@@ -291,6 +324,8 @@ class Transaction(abo.base.Base):
     transaction for humans, and a list of two or more Entries.
     """
 
+    __slots__ = ('date', 'edate', 'who', 'what', 'tags', 'is_projection', 'entries')
+
     def __init__(self, date=None, edate=None, who=None, what=None, tags=(), is_projection=False, entries=(), config=None):
         """Construct a new Transaction object, given its date, optional control
         date, description, and list of Entry objects.
@@ -299,9 +334,9 @@ class Transaction(abo.base.Base):
         assert len(entries) >= 2, 'too few entries: %r' % (entries,)
         self.date = date
         self.edate = edate if edate is not None else date
-        self.who = who
-        self.what = self._expand(what, config=config) if what else what
-        self.tags = frozenset(tags)
+        self.who = _intern(who) if who else who
+        self.what = _intern(self._expand(what, config=config)) if what else what
+        self.tags = _tags(tags)
         self.is_projection = is_projection
         # Construct member Entry objects and ensure that they sum to zero.
         ents = []
@@ -314,7 +349,13 @@ class Transaction(abo.base.Base):
                 ents.append(e)
             bal += e.amount
         assert bal == 0, 'entries sum to %r, should be zero: %s %s; %s\n   %s' % (bal, date, who, what, '\n   '.join(map(repr, entries)))
-        self.entries = tuple(sorted(ents, key=lambda e: (e.amount, e.account, e.detail)))
+        self.entries = tuple(sorted(ents, key=_entry_order))
+
+    def __reduce__(self):
+        # Entries are pickled as plain tuples rather than as Entry objects, and
+        # are attached to the Transaction again when unpickled.
+        return (_restore_transaction, (self.date, self.edate, self.who, self.what, self.tags, self.is_projection,
+                                       tuple((e.account, e.amount, e.cdate, e.detail) for e in self.entries)))
 
     def __repr__(self):
         r = []
@@ -376,6 +417,42 @@ class Transaction(abo.base.Base):
                 entries= self.entries if entries is None else list(entries)
             )
 
+    def _derive(self, entries, date=None, edate=None, is_projection=False, ordered=False):
+        """Return a new Transaction with the same who and what as this one,
+        like replace(), but trusting that the given entries already sum to
+        zero, so they are not checked.  Entries that are not attached to any
+        Transaction, eg, those returned by Entry.replace(), are adopted by the
+        new Transaction instead of being copied, so must not be used for
+        anything else.  If 'ordered' is true, the entries are already in the
+        same order as the constructor would sort them.
+        >>> t = Transaction(date=1, who="Someone", what="something",
+        ...         entries=({'account':'a1', 'amount':10}, {'account':'a2', 'amount':-10}))
+        >>> e = Entry(None, account='a3', amount=-10)
+        >>> t2 = t._derive([t.entries[1], e], date=2)
+        >>> t2
+        Transaction(date=2, who='Someone', what='something', entries=(Entry(account='a3', amount=-10), Entry(account='a1', amount=10)))
+        >>> t2.entries[0] is e, t2.entries[1] is t.entries[1], t2.entries[1].transaction is t2
+        (True, False, True)
+        """
+        t = Transaction.__new__(Transaction)
+        t.date = self.date if date is None else date
+        t.edate = t.date if edate is None else edate
+        t.who = self.who
+        t.what = self.what
+        t.tags = _no_tags
+        t.is_projection = is_projection
+        ents = []
+        for e in entries:
+            if e.transaction is None:
+                e.transaction = t
+            else:
+                e = e._attach(t)
+            ents.append(e)
+        if not ordered:
+            ents.sort(key=_entry_order)
+        t.entries = tuple(ents)
+        return t
+
     def split(self, account, amount):
         """Split this Transaction into two, by splitting all of its Entries on
         a given account into two sets, the first set summing to a given amount
@@ -420,7 +497,7 @@ class Transaction(abo.base.Base):
         assert sum(e.amount for e in chain(entries1, entries2) if e.account == account) == total
         assert sum(e.amount for e in entries1 if e.account == account) == amount
         assert sum(e.amount for e in other1 if e.account != account) == -amount, 'other1=%r amount=%r' % (other1, amount)
-        return self.replace(entries= entries1 + other1), self.replace(entries= entries2 + other2)
+        return self._derive(entries1 + other1), self._derive(entries2 + other2)
 
     _regex_expand_field = re.compile(r'%{(\w+)([+-]\d+)?}')
 
@@ -471,13 +548,36 @@ class Transaction(abo.base.Base):
             else:
                 amount = sum(e.amount for e in v)
                 if amount != 0:
-                    reduced_entries.append({'cdate': v[0].cdate, 'account': v[0].account, 'amount': amount})
-        return Transaction(date= self.date,
-                           edate= self.edate,
-                           who= self.who,
-                           what= self.what,
-                           is_projection= self.is_projection,
-                           entries=reduced_entries)
+                    reduced_entries.append(Entry(None, cdate=v[0].cdate, account=v[0].account, amount=amount))
+        return self._derive(reduced_entries, edate=self.edate, is_projection=self.is_projection)
+
+def _intern(text):
+    return sys.intern(text) if type(text) is str else text
+
+_no_tags = frozenset()
+_tag_sets = {_no_tags: _no_tags}
+
+def _tags(tags):
+    # Transactions with the same tags share a single frozenset.
+    tags = frozenset(tags)
+    return _tag_sets.setdefault(tags, tags)
+
+def _entry_order(entry):
+    return entry.amount, entry.account, entry.detail
+
+def _restore_transaction(date, edate, who, what, tags, is_projection, entries):
+    t = Transaction.__new__(Transaction)
+    t.date = date
+    t.edate = edate
+    t.who = _intern(who)
+    t.what = _intern(what)
+    t.tags = _tags(tags)
+    t.is_projection = is_projection
+    t.entries = tuple(Entry(t, account, amount, cdate, detail) for account, amount, cdate, detail in entries)
+    return t
+
+def _transaction_entry(transaction, index):
+    return transaction.entries[index]
 
 def _divide_entries(entries, amount):
     entries = sorted(entries, key=lambda e: (abs(e.amount), e.account))
@@ -558,6 +658,21 @@ __test__ = {
     >>> t.entries[0]
     Entry(account='a1', amount=-14.56, detail='else')
 """,
+'pickle':"""
+    >>> import pickle
+    >>> t = Transaction(date=1, who="Someone", what="something", \\
+    ...         entries=({'account':'a1', 'amount':-14.56, 'detail':'else'}, \\
+    ...                  {'account':'a2', 'amount':14.56, 'cdate': 7}))
+    >>> t2, e2 = pickle.loads(pickle.dumps((t, t.entries[1]), 2))
+    >>> t2 #doctest: +NORMALIZE_WHITESPACE
+    Transaction(date=1, who='Someone', what='something',
+                entries=(Entry(account='a1', amount=-14.56, detail='else'),
+                         Entry(account='a2', amount=14.56, cdate=7)))
+    >>> e2 is t2.entries[1], t2.entries[0].transaction is t2, t2.tags is t.tags
+    (True, True, True)
+    >>> hasattr(t2, '__dict__') or hasattr(e2, '__dict__')
+    False
+""",
 'errors':"""
     >>> t = Transaction(who="Someone", what="something", \\
     ...         entries=({'account':'a1', 'amount':14.56, 'detail':'else'}, \\